@@ -0,0 +1,195 @@
+"""Compares the JSON codecs and, if erlpack is installed, the ETF codec
+supported by discord.py on gateway payloads.
+
+Usage: ::
+
+    python benchmarks/json_codecs.py [payload.json ...]
+
+Every file passed is expected to contain a single recorded gateway
+payload (e.g. the ``msg`` received in :func:`on_socket_response`). If
+no files are given then synthetic READY, GUILD_CREATE and MESSAGE_CREATE
+payloads that are shaped like the real ones are used instead.
+
+Before timing anything, every codec is checked to decode the payloads
+to the same objects, so a codec that is fast but wrong fails loudly.
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from discord import utils, etf
+
+def snowflake(n):
+    return str(81384788765712384 + n)
+
+def user(n):
+    return {
+        'id': snowflake(n),
+        'username': 'user-{}'.format(n),
+        'discriminator': '{:04}'.format(n % 10000),
+        'avatar': 'a0b1c2d3e4f5a6b7c8d9e0f1a2b3c4d5',
+        'bot': False
+    }
+
+def member(n, roles):
+    return {
+        'user': user(n),
+        'roles': roles,
+        'nick': None,
+        'joined_at': '2016-08-12T17:11:23.874000+00:00',
+        'deaf': False,
+        'mute': False
+    }
+
+def guild(n, members=1000, channels=50, roles=30):
+    role_ids = [snowflake(n * 1000 + r) for r in range(roles)]
+    return {
+        'id': snowflake(n),
+        'name': 'guild-{}'.format(n),
+        'icon': None,
+        'splash': None,
+        'owner_id': snowflake(0),
+        'region': 'us-east',
+        'afk_channel_id': None,
+        'afk_timeout': 300,
+        'verification_level': 1,
+        'mfa_level': 0,
+        'features': [],
+        'large': members >= 250,
+        'member_count': members,
+        'roles': [{
+            'id': rid, 'name': 'role-{}'.format(i), 'color': 0, 'hoist': False,
+            'position': i, 'permissions': 104324161, 'managed': False, 'mentionable': False
+        } for i, rid in enumerate(role_ids)],
+        'emojis': [],
+        'channels': [{
+            'id': snowflake(n * 1000 + 500 + c), 'name': 'channel-{}'.format(c), 'type': 0,
+            'position': c, 'topic': None, 'permission_overwrites': []
+        } for c in range(channels)],
+        'members': [member(m, role_ids[m % roles:m % roles + 2]) for m in range(members)],
+        'presences': [{
+            'user': {'id': snowflake(m)}, 'status': 'online', 'game': {'name': 'discord.py'}
+        } for m in range(0, members, 3)],
+        'voice_states': []
+    }
+
+def synthetic_payloads():
+    ready = {
+        'op': 0, 's': 1, 't': 'READY',
+        'd': {
+            'v': 6,
+            'user': user(0),
+            'session_id': 'e3c1b5e3a7fca6e2c6f8f6d4b8c6c6a0',
+            'private_channels': [],
+            'guilds': [{'id': snowflake(g), 'unavailable': True} for g in range(2500)],
+            '_trace': ['gateway-prd-main-abcd']
+        }
+    }
+
+    guild_create = {'op': 0, 's': 2, 't': 'GUILD_CREATE', 'd': guild(1)}
+
+    message_create = {
+        'op': 0, 's': 3, 't': 'MESSAGE_CREATE',
+        'd': {
+            'id': snowflake(123456),
+            'channel_id': snowflake(1500),
+            'author': user(42),
+            'content': 'Hello, world! ✨ ' * 10,
+            'timestamp': '2017-01-11T12:34:56.789000+00:00',
+            'edited_timestamp': None,
+            'tts': False,
+            'mention_everyone': False,
+            'mentions': [user(n) for n in range(3)],
+            'mention_roles': [],
+            'attachments': [],
+            'embeds': [],
+            'nonce': snowflake(987654),
+            'pinned': False,
+            'type': 0
+        }
+    }
+
+    return [('READY', ready), ('GUILD_CREATE', guild_create), ('MESSAGE_CREATE', message_create)]
+
+def recorded_payloads(paths):
+    codec = utils.get_json_codec()
+    result = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            result.append((os.path.basename(path), codec.loads(f.read())))
+    return result
+
+def with_int_snowflakes(obj):
+    # Discord sends snowflakes as integers when using ETF
+    if isinstance(obj, dict):
+        return {k: with_int_snowflakes(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [with_int_snowflakes(v) for v in obj]
+    if isinstance(obj, str) and obj.isdigit() and int(obj) >= 2 ** 32:
+        return int(obj)
+    return obj
+
+def check_etf_terms():
+    # terms as Discord encodes them, next to what the library expects
+    terms = [
+        (b'\x83a\x05', 5),
+        (b'\x83b\xff\xff\xff\xfe', -2),
+        (b'\x83n\x04\x00\x00\x00\x00\x80', 2 ** 31),
+        (b'\x83n\x04\x00\xff\xff\xff\xff', 2 ** 32 - 1),
+        (b'\x83n\x04\x01\x00\x00\x00\x80', -2 ** 31),
+        (b'\x83n\x08\x00\x00\x20\x80\xc0\x08\x23\x21\x01', '81384788765712384'),
+        (b'\x83s\x03nil', None),
+        (b'\x83w\x04true', True),
+        (b'\x83m\x00\x00\x00\x02hi', 'hi'),
+        (b'\x83j', []),
+        (b'\x83t\x00\x00\x00\x01m\x00\x00\x00\x01al\x00\x00\x00\x01a\x01j', {'a': [1]}),
+    ]
+    for raw, expected in terms:
+        result = etf.loads(raw)
+        if result != expected or type(result) is not type(expected):
+            raise AssertionError('etf decoded {!r} as {!r}, expected {!r}'.format(raw, result, expected))
+
+def check_codecs(codecs, payloads):
+    if etf.erlpack is not None:
+        check_etf_terms()
+    for name, payload in payloads:
+        for codec in codecs:
+            if codec.name == 'etf':
+                # snowflakes are sent as integers and decoded as strings
+                decoded = [codec.loads(codec.dumps(payload)),
+                           codec.loads(etf.dumps(with_int_snowflakes(payload)))]
+            else:
+                decoded = [codec.loads(codec.dumps(payload)),
+                           codec.loads(utils.to_json(payload).encode('utf-8'))]
+
+            if any(result != payload for result in decoded):
+                raise AssertionError('{} does not round-trip the {} payload'.format(codec.name, name))
+
+def main(argv):
+    payloads = recorded_payloads(argv) if argv else synthetic_payloads()
+    codecs = [utils.get_json_codec(name) for name in sorted(utils._json_codecs)]
+    if etf.erlpack is not None:
+        codecs.append(utils.JSONCodec('etf', etf.dumps, etf.loads))
+    else:
+        print('erlpack is not installed, ETF is left out.')
+    check_codecs(codecs, payloads)
+
+    print('{:<16} {:<10} {:>10} {:>12} {:>12}'.format('payload', 'codec', 'size', 'loads (us)', 'dumps (us)'))
+    for name, payload in payloads:
+        number = max(1, 2000000 // len(utils.to_json(payload)))
+        for codec in codecs:
+            if codec.name == 'etf':
+                raw = etf.dumps(with_int_snowflakes(payload))
+            else:
+                raw = utils.to_json(payload).encode('utf-8')
+
+            loads = timeit.timeit(lambda: codec.loads(raw), number=number) / number
+            dumps = timeit.timeit(lambda: codec.dumps(payload), number=number) / number
+            print('{:<16} {:<10} {:>10} {:>12.1f} {:>12.1f}'.format(name, codec.name, len(raw),
+                                                                   loads * 1e6, dumps * 1e6))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,110 @@
+"""Compares the message cache of the ConnectionState with the deque that
+was used before it, on the operations the gateway events perform.
+
+Usage: ::
+
+    python benchmarks/message_cache.py [--max-messages N]
+
+The cache is filled to ``max_messages`` (100000 by default) and then
+looked up, updated and deleted from by ID the way MESSAGE_UPDATE,
+MESSAGE_REACTION_ADD, MESSAGE_DELETE and MESSAGE_DELETE_BULK do.
+"""
+
+import argparse
+import os
+import random
+import sys
+import timeit
+from collections import deque
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from discord import utils
+from discord.state import MessageCache
+
+class FakeMessage:
+    __slots__ = ('id', 'content')
+
+    def __init__(self, id):
+        self.id = id
+        self.content = 'Hello, world!'
+
+def snowflake(n):
+    return str(81384788765712384 + n)
+
+class DequeCache:
+    # the previous implementation, kept for comparison
+    def __init__(self, maxlen):
+        self.messages = deque(maxlen=maxlen)
+
+    def append(self, message):
+        self.messages.append(message)
+
+    def get(self, message_id):
+        return utils.find(lambda m: m.id == message_id, self.messages)
+
+    def delete(self, message_id):
+        found = self.get(message_id)
+        if found is not None:
+            self.messages.remove(found)
+
+    def delete_bulk(self, message_ids):
+        message_ids = set(message_ids)
+        for msg in list(filter(lambda m: m.id in message_ids, self.messages)):
+            self.messages.remove(msg)
+
+class IndexedCache:
+    def __init__(self, maxlen):
+        self.messages = MessageCache(maxlen)
+
+    def append(self, message):
+        self.messages.append(message)
+
+    def get(self, message_id):
+        return self.messages.get(message_id)
+
+    def delete(self, message_id):
+        self.messages.pop(message_id)
+
+    def delete_bulk(self, message_ids):
+        for message_id in message_ids:
+            self.messages.pop(message_id)
+
+def run(cls, max_messages, ids, number):
+    cache = cls(max_messages)
+    # fill it past the limit so the eviction path is measured too
+    append = timeit.timeit(lambda: [cache.append(FakeMessage(snowflake(n))) for n in range(max_messages * 2)],
+                           number=1) / (max_messages * 2)
+
+    lookups = iter(ids)
+    get = timeit.timeit(lambda: cache.get(next(lookups)), number=number) / number
+
+    deletes = iter(ids)
+    delete = timeit.timeit(lambda: cache.delete(next(deletes)), number=number) / number
+
+    bulk_ids = [ids[number + i * 100:number + (i + 1) * 100] for i in range(max(1, number // 100))]
+    bulks = iter(bulk_ids)
+    bulk = timeit.timeit(lambda: cache.delete_bulk(next(bulks)), number=len(bulk_ids)) / len(bulk_ids)
+    return append, get, delete, bulk
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmarks the message cache.')
+    parser.add_argument('--max-messages', type=int, default=100000)
+    parser.add_argument('--number', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    max_messages = args.max_messages
+    # only the newest max_messages are still cached after filling
+    ids = [snowflake(n) for n in range(max_messages, max_messages * 2)]
+    random.seed(0)
+    random.shuffle(ids)
+
+    print('max_messages={}'.format(max_messages))
+    print('{:<10} {:>12} {:>12} {:>12} {:>16}'.format('cache', 'append (us)', 'get (us)', 'delete (us)',
+                                                      'bulk 100 (us)'))
+    for name, cls in (('deque', DequeCache), ('indexed', IndexedCache)):
+        timings = run(cls, max_messages, ids, args.number)
+        print('{:<10} {:>12.2f} {:>12.2f} {:>12.2f} {:>16.2f}'.format(name, *(t * 1e6 for t in timings)))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,40 @@
+"""Replays a gateway recording through a client and reports how long it took.
+
+Usage: ::
+
+    python benchmarks/replay.py recording.bin [--json-codec NAME] [--ignore EVENT ...]
+
+The recording is written by passing ``recorder='recording.bin'`` to a
+:class:`discord.Client`. No connection to Discord is made, so this can be
+used to compare parse handlers and cache settings on real traffic.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import discord
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Replays a gateway recording.')
+    parser.add_argument('recording')
+    parser.add_argument('--json-codec', default=None)
+    parser.add_argument('--ignore', nargs='*', default=(), metavar='EVENT')
+    parser.add_argument('--max-messages', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    loop = asyncio.get_event_loop()
+    client = discord.Client(loop=loop, json_codec=args.json_codec, ignored_events=args.ignore,
+                            max_messages=args.max_messages)
+
+    stats = loop.run_until_complete(discord.GatewayReplay(args.recording, client).run())
+    print('{0.frames} messages in {0.elapsed:.3f}s ({1:.0f} messages/s)'.format(stats, stats.frames / stats.elapsed))
+    print('{} servers, {} members, {} messages cached'.format(len(client.servers),
+                                                            sum(len(s.members) for s in client.servers),
+                                                            len(client.messages)))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
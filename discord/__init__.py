@@ -18,6 +18,10 @@ __copyright__ = 'Copyright 2015-2016 Rapptz'
 __version__ = '0.16.12'
 
 from .client import Client, AppInfo, ChannelPermissions
+from .shard import AutoShardedClient
+from .sessions import SessionStore, FileSessionStore, SQLiteSessionStore
+from .recording import GatewayRecorder, GatewayReplay
+from .member_cache import MemberCachePolicy
 from .user import User
 from .game import Game
 from .emoji import Emoji
@@ -137,7 +137,7 @@ class Channel(Hashable):
         their default values in the :attr:`Server.roles` attribute."""
         ret = []
         for overwrite in filter(lambda o: o.type == 'role', self._permission_overwrites):
-            role = utils.get(self.server.roles, id=overwrite.id)
+            role = self.server.get_role(overwrite.id)
             if role is None:
                 continue
 
@@ -211,8 +211,7 @@ class Channel(Hashable):
             overwrite = PermissionOverwrite.from_pair(allow, deny)
 
             if ow.type == 'role':
-                # accidentally quadratic
-                target = utils.find(lambda r: r.id == ow.id, self.server.roles)
+                target = self.server.get_role(ow.id)
             elif ow.type == 'member':
                 target = self.server.get_member(ow.id)
 
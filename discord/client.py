@@ -35,15 +35,17 @@ from .object import Object
 from .reaction import Reaction
 from .role import Role
 from .errors import *
-from .state import ConnectionState
+from .state import ConnectionState, HISTORY_EVENTS
 from .permissions import Permissions, PermissionOverwrite
-from . import utils, compat
+from . import utils, compat, etf
 from .enums import ChannelType, ServerRegion, VerificationLevel, Status
 from .voice_client import VoiceClient
 from .iterators import LogsFromIterator
 from .gateway import *
 from .emoji import Emoji
 from .http import HTTPClient
+from .sessions import SessionStore, FileSessionStore
+from .recording import GatewayRecorder
 
 import asyncio
 import aiohttp
@@ -85,7 +87,6 @@ class Client:
 
     A number of options can be passed to the :class:`Client`.
 
-    .. _deque: https://docs.python.org/3.4/library/collections.html#collections.deque
     .. _event loop: https://docs.python.org/3/library/asyncio-eventloops.html
     .. _connector: http://aiohttp.readthedocs.org/en/stable/client_reference.html#connectors
     .. _ProxyConnector: http://aiohttp.readthedocs.org/en/stable/client_reference.html#proxyconnector
@@ -96,6 +97,19 @@ class Client:
         The maximum number of messages to store in :attr:`messages`.
         This defaults to 5000. Passing in `None` or a value less than 100
         will use the default instead of the passed in value.
+    max_messages_per_channel : Optional[int]
+        The maximum number of messages to store in :attr:`messages` for
+        each channel, so that a busy channel can't evict the messages of
+        every other channel. ``max_messages`` still limits the total. When
+        set, :meth:`get_message` and :meth:`logs_from` answer from the
+        cache the history it is known to hold completely, i.e. messages
+        received since the client connected. The history of a channel is
+        requested again after the client's permissions in it might have
+        changed. Defaults to ``None``, which only uses the total limit and
+        always requests the history.
+    member_cache_policy : Optional[:class:`MemberCachePolicy`]
+        Decides which members are kept in :attr:`Server.members`. Defaults
+        to ``None``, which caches every member.
     loop : Optional[event loop].
         The `event loop`_ to use for asynchronous operations. Defaults to ``None``,
         in which case the default event loop is used via ``asyncio.get_event_loop()``.
@@ -110,6 +124,108 @@ class Client:
         Integer starting at 0 and less than shard_count.
     shard_count : Optional[int]
         The total number of shards.
+    compress : Optional[str]
+        The transport compression to use for the gateway. Currently the only
+        supported value is ``'zlib-stream'``, which keeps a single zlib context
+        for the lifetime of the connection instead of compressing each payload
+        separately. Defaults to ``None``, which uses per-payload compression.
+    encoding : Optional[str]
+        The encoding of the gateway payloads, either ``'json'`` or ``'etf'``
+        (Erlang External Term Format). ETF requires the erlpack library, and
+        the snowflakes it decodes are turned into strings like in JSON.
+        ETF frames are about as large as JSON ones and decoding them is
+        slower than decoding JSON, so it is only worth it where the
+        gateway's own encoding matters, e.g. when the payloads are relayed
+        as they are. Per-payload compression is only available with JSON,
+        ``'zlib-stream'`` works with both. Defaults to ``'json'``.
+    json_codec
+        The JSON library used to encode and decode gateway and HTTP payloads.
+        Passing ``'auto'`` picks the fastest of orjson, rapidjson or ujson
+        that is installed. See :func:`utils.get_json_codec` for the accepted
+        values. Defaults to ``None``, which uses the standard library.
+    max_concurrency : Optional[int]
+        The number of shards that are allowed to IDENTIFY at the same time.
+        Only change this if Discord raised the limit for your bot. Defaults to 1.
+    identify_interval : Optional[float]
+        The number of seconds to wait between two IDENTIFY payloads of the
+        same rate limit bucket. Defaults to 5 seconds.
+    ignored_events : Optional[iterable of str]
+        Gateway event names, e.g. ``'PRESENCE_UPDATE'`` or ``'TYPING_START'``,
+        that are dropped before they are decoded. Ignored events never update
+        the cache nor get dispatched. ``READY`` and ``RESUMED`` can not be ignored.
+        Ignoring any of the message or reaction events stops
+        :meth:`logs_from` from answering from the cache. Events the library
+        itself waits for, such as the ``VOICE_STATE_UPDATE`` and
+        ``VOICE_SERVER_UPDATE`` of :meth:`join_voice_channel`, are decoded
+        while it waits so that it doesn't wait forever, but they still don't
+        update the cache.
+    guild_allowlist : Optional[iterable]
+        The IDs (or :class:`Server`/:class:`Object` instances) of the only
+        servers to receive events for. Events of other servers are dropped
+        before they update the cache. Like with ``ignored_events``, the
+        events the library waits for still reach it. Defaults to ``None``,
+        which allows every server.
+    receive_queue_size : Optional[int]
+        The number of received gateway messages that can wait to be processed.
+        A separate task takes the messages from the websocket as they arrive,
+        so the time they wait is known and the client notices when it falls
+        behind. HEARTBEAT_ACKs are handled as soon as they arrive, so a
+        backlog is not mistaken for a dead connection. Defaults to 1000.
+    receive_queue_full : Optional[str]
+        What to do when the receive queue is full. ``'block'`` stops taking
+        messages from the websocket until there is room again. The websockets
+        library keeps reading the socket in the meantime, so the messages wait
+        in its own buffer instead. ``'reconnect'`` drops the queued messages
+        and RESUMEs, so Discord sends them again once the client caught up.
+        Defaults to ``'block'``.
+    offload_threshold : Optional[int]
+        Compressed gateway payloads of at least this many bytes are
+        decompressed in the event loop's default executor, since zlib
+        releases the GIL while it inflates. Decoding the JSON or ETF holds
+        the GIL, so it still happens on the event loop where a thread
+        would not make it any shorter. The payloads are processed in the
+        order they were received. ``None`` decompresses everything on the
+        event loop. Defaults to 1 MiB.
+    guild_ready_timeout : Optional[float]
+        The number of seconds to keep waiting for the servers that were
+        unavailable in READY when none of them arrived in the meantime.
+        :func:`on_ready` is dispatched as soon as every server arrived and
+        the members of the large ones were received, or once this timeout
+        expires. Defaults to 2 seconds.
+    chunk_guilds_at_startup : Optional[bool]
+        Whether to request the offline members of every large server before
+        :func:`on_ready` is dispatched. If ``False`` the members of a large
+        server are only loaded by :meth:`Server.chunk`, or in the background
+        when ``background_chunk_interval`` is set, which keeps startup time
+        and memory proportional to the servers that are actually used.
+        :attr:`Server.chunked` tells if a server has all of its members.
+        Defaults to ``True``.
+    background_chunk_interval : Optional[float]
+        Only used when ``chunk_guilds_at_startup`` is ``False``. The number of
+        seconds to wait between the member requests of the servers that are
+        chunked one at a time after :func:`on_ready`. Defaults to ``None``,
+        which disables chunking in the background.
+    session_store : Optional[Union[:class:`SessionStore`, str]]
+        Where to save the gateway session of every shard when the client is
+        closed, so that the next process can RESUME it instead of doing a full
+        IDENTIFY. A string is interpreted as the path of a :class:`FileSessionStore`.
+        A RESUME is only attempted when the cache already has servers in it,
+        since the events replayed by Discord need something to apply to.
+        Defaults to ``None``, which disables persisting sessions.
+    warm_cache : Optional[str]
+        The path of a snapshot of the cache. The snapshot is written when the
+        client is closed and loaded back before connecting, which is faster than rebuilding the cache from
+        GUILD_CREATE and member chunks. It is meant to be used together with
+        ``session_store``: a resumed session brings the loaded cache up to date
+        and :func:`on_ready` is dispatched right after :func:`on_resumed`.
+        If the session can not be resumed the snapshot is replaced by the data
+        of the new session. The snapshot is a pickle, and loading a pickle can
+        run arbitrary code, so the file must not be writable by anyone you
+        don't trust. Defaults to ``None``.
+    recorder : Optional[Union[:class:`GatewayRecorder`, str]]
+        Records every message received from the gateway so that it can be
+        replayed later with :class:`GatewayReplay`. A string is interpreted
+        as the path of the recording. Defaults to ``None``.
 
     Attributes
     -----------
@@ -124,9 +240,10 @@ class Client:
     private_channels : iterable of :class:`PrivateChannel`
         The private channels that the connected client is participating on.
     messages
-        A deque_ of :class:`Message` that the client has received from all
-        servers and private messages. The number of messages stored in this
-        deque is controlled by the ``max_messages`` parameter.
+        The :class:`Message` objects that the client has received from all
+        servers and private messages, oldest first. It can be iterated and
+        indexed like a deque. The number of messages stored is controlled by
+        the ``max_messages`` parameter.
     email
         The email used to login. This is only set if login is successful,
         otherwise it's None.
@@ -136,6 +253,10 @@ class Client:
         The `event loop`_ that the client uses for HTTP requests and websocket operations.
 
     """
+
+    # the cache made by _get_state, subclasses swap it for their own
+    _state_class = ConnectionState
+
     def __init__(self, *, loop=None, **options):
         self.ws = None
         self.email = None
@@ -145,15 +266,57 @@ class Client:
         self.shard_id = options.get('shard_id')
         self.shard_count = options.get('shard_count')
 
+        self._ignored_events = frozenset(e.upper() for e in options.get('ignored_events', ()))
+
+        allowlist = options.get('guild_allowlist')
+        if allowlist is not None:
+            allowlist = frozenset(str(getattr(g, 'id', g)) for g in allowlist)
+        self._guild_allowlist = allowlist
+
+        session_store = options.get('session_store')
+        if isinstance(session_store, str):
+            session_store = FileSessionStore(session_store)
+        elif session_store is not None and not isinstance(session_store, SessionStore):
+            raise InvalidArgument('session_store must be a SessionStore or a path')
+        self._session_store = session_store
+        self._warm_cache = options.get('warm_cache')
+
+        recorder = options.get('recorder')
+        if isinstance(recorder, str):
+            recorder = GatewayRecorder(recorder)
+        self._recorder = recorder
+
+        self._compress = options.get('compress')
+        if self._compress not in (None, 'zlib-stream'):
+            raise InvalidArgument('compress must be None or "zlib-stream"')
+
+        self._receive_queue_size = options.get('receive_queue_size', 1000)
+        self._receive_queue_full = options.get('receive_queue_full', 'block')
+        if self._receive_queue_full not in ('block', 'reconnect'):
+            raise InvalidArgument('receive_queue_full must be "block" or "reconnect"')
+
+        self._offload_threshold = options.get('offload_threshold', 1024 * 1024)
+
+        self._encoding = options.get('encoding', 'json')
+        if self._encoding not in ('json', 'etf'):
+            raise InvalidArgument('encoding must be "json" or "etf"')
+        if self._encoding == 'etf' and etf.erlpack is None:
+            raise InvalidArgument('encoding "etf" requires erlpack to be installed')
+
         max_messages = options.get('max_messages')
         if max_messages is None or max_messages < 100:
             max_messages = 5000
 
-        self.connection = ConnectionState(self.dispatch, self.request_offline_members,
-                                          self._syncer, max_messages, loop=self.loop)
+        options['max_messages'] = max_messages
+        self.connection = self._get_state(**options)
+        if self._ignored_events & HISTORY_EVENTS:
+            self.connection.cached_history = False
+        self._identify_scheduler = IdentifyScheduler(max_concurrency=options.get('max_concurrency') or 1,
+                                                     interval=options.get('identify_interval', 5.0),
+                                                     loop=self.loop)
 
         connector = options.pop('connector', None)
-        self.http = HTTPClient(connector, loop=self.loop)
+        self.http = HTTPClient(connector, loop=self.loop, json_codec=options.pop('json_codec', None))
 
         self._closed = asyncio.Event(loop=self.loop)
         self._is_logged_in = asyncio.Event(loop=self.loop)
@@ -165,6 +328,41 @@ class Client:
 
     # internals
 
+    def _get_state(self, **options):
+        return self._state_class(self.dispatch, self.request_offline_members,
+                                 self._syncer, options['max_messages'], loop=self.loop,
+                                 guild_ready_timeout=options.get('guild_ready_timeout', 2.0),
+                                 chunk_guilds_at_startup=options.get('chunk_guilds_at_startup', True),
+                                 background_chunk_interval=options.get('background_chunk_interval'),
+                                 max_messages_per_channel=options.get('max_messages_per_channel'),
+                                 member_cache_policy=options.get('member_cache_policy'))
+
+    def _get_websocket(self, guild_id):
+        return self.ws
+
+    def _get_websockets(self):
+        return [self.ws] if self.ws is not None else []
+
+    def _load_session(self, shard_id):
+        if self._session_store is None or not self.connection._servers:
+            return None, None
+        return self._session_store.get(shard_id or 0)
+
+    @asyncio.coroutine
+    def _load_warm_cache(self):
+        if self._warm_cache is not None and not self.connection._servers:
+            yield from self.connection.load(self._warm_cache)
+
+    def _save_sessions(self):
+        for ws in self._get_websockets():
+            if ws.session_id is None:
+                continue
+
+            try:
+                self._session_store.save(ws.shard_id or 0, ws.session_id, ws.sequence)
+            except Exception:
+                log.exception('Failed to save the session of shard ID {}'.format(ws.shard_id))
+
     @asyncio.coroutine
     def _syncer(self, guilds):
         yield from self.ws.request_sync(guilds)
@@ -441,14 +639,23 @@ class Client:
         ConnectionClosed
             The websocket connection has been terminated.
         """
-        self.ws = yield from DiscordWebSocket.from_client(self)
+        yield from self._load_warm_cache()
+        session, sequence = self._load_session(self.shard_id)
+        self.ws = yield from DiscordWebSocket.from_client(self, session=session, sequence=sequence,
+                                                          resume=session is not None)
 
         while not self.is_closed:
             try:
                 yield from self.ws.poll_event()
             except ResumeWebSocket:
+                if self.is_closed:
+                    break
+
                 log.info('Got ResumeWebsocket')
-                self.ws = yield from DiscordWebSocket.from_client(self, resume=True)
+                yield from self.ws._drain_backlogs()
+                self.ws = yield from DiscordWebSocket.from_client(self, session=self.ws.session_id,
+                                                                  sequence=self.ws.sequence,
+                                                                  resume=True)
             except ConnectionClosed as e:
                 yield from self.close()
                 if e.code != 1000:
@@ -463,6 +670,9 @@ class Client:
         if self.is_closed:
             return
 
+        # set early so that the websockets closing below don't reconnect
+        self._closed.set()
+
         for voice in list(self.voice_clients):
             try:
                 yield from voice.disconnect()
@@ -472,12 +682,26 @@ class Client:
 
             self.connection._remove_voice_client(voice.server.id)
 
-        if self.ws is not None and self.ws.open:
-            yield from self.ws.close()
+        code = 1000
+        if self._session_store is not None:
+            self._save_sessions()
+            # closing with 1000 would make Discord invalidate the session
+            code = 4000
 
+        if self._warm_cache is not None and self.connection._servers:
+            try:
+                self.connection.dump(self._warm_cache)
+            except Exception:
+                log.exception('Failed to write the cache snapshot')
+
+        for ws in self._get_websockets():
+            if ws.open:
+                yield from ws.close(code)
+
+        if self._recorder is not None:
+            self._recorder.close()
 
         yield from self.http.close()
-        self._closed.set()
         self._is_ready.clear()
 
     @asyncio.coroutine
@@ -544,6 +768,17 @@ class Client:
         """bool: Indicates if the websocket connection is closed."""
         return self._closed.is_set()
 
+    @property
+    def latency(self):
+        """float: Measures latency between a HEARTBEAT and a HEARTBEAT_ACK in seconds.
+
+        This could be referred to as the Discord WebSocket protocol latency.
+        """
+        ws = self.ws
+        if not ws:
+            return float('nan')
+        return ws.latency
+
     # helpers/getters
 
     def get_channel(self, id):
@@ -1446,7 +1681,9 @@ class Client:
 
         Retrieves a single :class:`Message` from a :class:`Channel`.
 
-        This can only be used by bot accounts.
+        This can only be used by bot accounts. If the message is in
+        :attr:`messages` then no request is made, unless message events
+        are in ``ignored_events`` since the cached copy might be stale.
 
         Parameters
         ------------
@@ -1470,6 +1707,11 @@ class Client:
             Retrieving the message failed.
         """
 
+        # the cached copy might be stale if message events are ignored
+        message = self.connection._get_message(id) if self.connection.cached_history else None
+        if message is not None and getattr(message.channel, 'id', None) == channel.id:
+            return message
+
         data = yield from self.http.get_message(channel.id, id)
         return self.connection._create_message(channel=channel, **data)
 
@@ -1676,7 +1918,73 @@ class Client:
             }
         }
 
-        yield from self.ws.send_as_json(payload)
+        ws = self._get_websocket(server.id if hasattr(server, 'id') else None)
+        yield from ws.send_as_json(payload)
+
+    @asyncio.coroutine
+    def query_members(self, server, query=None, *, limit=5, user_ids=None):
+        """|coro|
+
+        Requests the members of a server whose username or nickname starts
+        with the query string, or the members with the given IDs. The
+        members received are added to the :attr:`Server.members` cache
+        unless the ``member_cache_policy`` rejects them, so use the
+        returned list rather than looking them up in the cache.
+
+        This is useful to look up members of a server that is not
+        :attr:`Server.chunked` without requesting every member of it.
+
+        Parameters
+        -----------
+        server : :class:`Server`
+            The server to look up the members of.
+        query : Optional[str]
+            The string the username or nickname of the members starts with.
+        limit : int
+            The maximum number of members to return for the query, at most 100.
+        user_ids : Optional[list of str]
+            The IDs of the members to request instead of a query, at most 100.
+
+        Raises
+        -------
+        InvalidArgument
+            Neither or both of the query and the user IDs were given, or
+            the limit or the number of IDs is not between 1 and 100.
+        asyncio.TimeoutError
+            Discord did not answer in time.
+
+        Returns
+        --------
+        list of :class:`Member`
+            The members that matched the query.
+        """
+
+        if (query is None) == (user_ids is None):
+            raise InvalidArgument('either query or user_ids must be given')
+
+        if user_ids is not None:
+            user_ids = list(user_ids)
+            if not 1 <= len(user_ids) <= 100:
+                raise InvalidArgument('user_ids must have between 1 and 100 IDs')
+            data = { 'user_ids': user_ids }
+        elif not 1 <= limit <= 100:
+            raise InvalidArgument('limit must be between 1 and 100')
+        else:
+            data = { 'query': query, 'limit': limit }
+
+        nonce, future = self.connection._add_member_query(server)
+        data['guild_id'] = server.id
+        data['nonce'] = nonce
+        payload = {
+            'op': 8,
+            'd': data
+        }
+
+        try:
+            yield from self._get_websocket(server.id).send_as_json(payload)
+            return (yield from asyncio.wait_for(future, timeout=30.0, loop=self.loop))
+        finally:
+            self.connection._member_queries.pop(nonce, None)
 
     @asyncio.coroutine
     def kick(self, member):
@@ -2277,7 +2585,7 @@ class Client:
             region = region.value
 
         data = yield from self.http.create_server(name, region, icon)
-        return Server(**data)
+        return Server(state=self.connection, **data)
 
     @asyncio.coroutine
     def edit_server(self, server, **fields):
@@ -3182,18 +3490,20 @@ class Client:
             guild_id = data.get('guild_id')
             return user_id == self.user.id and guild_id == server.id
 
+        ws = self._get_websocket(server.id)
+
         # register the futures for waiting
-        session_id_future = self.ws.wait_for('VOICE_STATE_UPDATE', session_id_found)
-        voice_data_future = self.ws.wait_for('VOICE_SERVER_UPDATE', lambda d: d.get('guild_id') == server.id)
+        session_id_future = ws.wait_for('VOICE_STATE_UPDATE', session_id_found)
+        voice_data_future = ws.wait_for('VOICE_SERVER_UPDATE', lambda d: d.get('guild_id') == server.id)
 
         # request joining
-        yield from self.ws.voice_state(server.id, channel.id)
+        yield from ws.voice_state(server.id, channel.id)
 
         try:
             session_id_data = yield from asyncio.wait_for(session_id_future, timeout=10.0, loop=self.loop)
             data = yield from asyncio.wait_for(voice_data_future, timeout=10.0, loop=self.loop)
         except asyncio.TimeoutError as e:
-            yield from self.ws.voice_state(server.id, None, self_mute=True)
+            yield from ws.voice_state(server.id, None, self_mute=True)
             raise e
 
         kwargs = {
@@ -3202,7 +3512,7 @@ class Client:
             'data': data,
             'loop': self.loop,
             'session_id': session_id_data.get('session_id'),
-            'main_ws': self.ws
+            'main_ws': ws
         }
 
         voice = VoiceClient(**kwargs)
@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+
+"""
+The MIT License (MIT)
+
+Copyright (c) 2015-2016 Rapptz
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+from .http import HTTPClient
+from .game import Game
+from .enums import Status, try_enum
+from .errors import ClientException
+from . import utils, compat
+
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import tempfile
+
+log = logging.getLogger(__name__)
+
+__all__ = [ 'ShardCluster', 'ClusterClient' ]
+
+class _Worker:
+    __slots__ = ('id', 'shard_ids', 'process', 'writer', 'launched')
+
+    def __init__(self, id, shard_ids):
+        self.id = id
+        self.shard_ids = shard_ids
+        self.process = None
+        self.writer = None
+        self.launched = None
+
+def _send(writer, payload):
+    writer.write(utils.to_json(payload).encode('utf-8') + b'\n')
+
+def _run_worker(client_class, token, worker_id, shard_ids, shard_count, path, options):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    client = client_class(loop=loop, shard_ids=shard_ids, shard_count=shard_count, **options)
+    client.cluster = ClusterClient(client, path, worker_id)
+    try:
+        loop.run_until_complete(client.cluster.start(token))
+    except KeyboardInterrupt:
+        loop.run_until_complete(client.logout())
+    finally:
+        loop.close()
+
+class ClusterClient:
+    """The worker side of a :class:`ShardCluster`.
+
+    An instance of this is available as the ``cluster`` attribute of every
+    client that was launched by a :class:`ShardCluster`. It is used to query
+    the other worker processes of the cluster.
+
+    Custom requests can be answered by adding a ``handle_<type>`` method or
+    coroutine to a subclass, which receives the data sent with the request.
+
+    Attributes
+    -----------
+    client : :class:`AutoShardedClient`
+        The client running in this worker process.
+    worker_id : int
+        The index of this worker process in the cluster.
+    """
+
+    def __init__(self, client, path, worker_id):
+        self.client = client
+        self.loop = client.loop
+        self.path = path
+        self.worker_id = worker_id
+        self._writer = None
+        self._pending = {}
+        self._nonce = itertools.count()
+
+    @asyncio.coroutine
+    def start(self, token):
+        reader, self._writer = yield from asyncio.open_unix_connection(self.path, loop=self.loop)
+        _send(self._writer, { 'op': 'hello', 'd': self.worker_id })
+        compat.create_task(self._poll(reader), loop=self.loop)
+
+        yield from self.client.login(token)
+        tasks = yield from self.client.launch_shards()
+
+        # let the parent know it can start IDENTIFYing the next block
+        _send(self._writer, { 'op': 'launched', 'd': self.worker_id })
+        yield from self.client._poll_shards(tasks)
+
+    @asyncio.coroutine
+    def _poll(self, reader):
+        while True:
+            line = yield from reader.readline()
+            if not line:
+                log.warning('Lost the connection to the cluster parent.')
+                break
+
+            msg = utils.get_json_codec().loads(line)
+            op = msg.get('op')
+            if op == 'response':
+                future = self._pending.pop(msg['nonce'], None)
+                if future is not None and not future.done():
+                    future.set_result(msg['d'])
+            elif op == 'request':
+                compat.create_task(self._handle(msg), loop=self.loop)
+
+    @asyncio.coroutine
+    def _handle(self, msg):
+        handler = getattr(self, 'handle_' + msg['t'], None)
+        result = None
+        if handler is None:
+            log.info('Unhandled cluster request {}'.format(msg['t']))
+        else:
+            try:
+                result = handler(msg.get('d'))
+                if asyncio.iscoroutine(result):
+                    result = yield from result
+            except Exception:
+                log.exception('Error while handling cluster request {}'.format(msg['t']))
+                result = None
+
+        _send(self._writer, { 'op': 'response', 'nonce': msg['nonce'], 'd': result })
+
+    @asyncio.coroutine
+    def request(self, type, data=None, *, timeout=30.0):
+        """|coro|
+
+        Sends a request to every worker in the cluster, including this one.
+
+        Parameters
+        -----------
+        type : str
+            The type of request. Each worker answers it with its
+            ``handle_<type>`` method.
+        data
+            JSON serialisable data passed to the handlers.
+        timeout : float
+            The number of seconds to wait for every worker to answer.
+
+        Returns
+        --------
+        list
+            The answer of every worker. Workers that are not running are skipped.
+        """
+        nonce = next(self._nonce)
+        future = asyncio.Future(loop=self.loop)
+        self._pending[nonce] = future
+        _send(self._writer, { 'op': 'request', 't': type, 'nonce': nonce, 'd': data })
+        try:
+            return (yield from asyncio.wait_for(future, timeout=timeout, loop=self.loop))
+        finally:
+            self._pending.pop(nonce, None)
+
+    @asyncio.coroutine
+    def find_server(self, server_id):
+        """|coro|
+
+        Returns the shard ID of the shard that has the server with the given
+        ID in its cache. If no shard has the server then ``None`` is returned.
+        """
+        results = yield from self.request('find_server', server_id)
+        return utils.find(lambda r: r is not None, results)
+
+    @asyncio.coroutine
+    def server_count(self):
+        """|coro|
+
+        Returns the number of servers cached across the whole cluster.
+        """
+        results = yield from self.request('server_count')
+        return sum(r for r in results if r is not None)
+
+    @asyncio.coroutine
+    def change_presence(self, *, game=None, status=None, afk=False):
+        """|coro|
+
+        Changes the presence of every shard in the cluster.
+
+        The parameters are the same as :meth:`Client.change_presence`.
+        """
+        data = {
+            'game': dict(game) if game else None,
+            'status': str(status) if status is not None else None,
+            'afk': afk
+        }
+        yield from self.request('change_presence', data)
+
+    def handle_find_server(self, server_id):
+        server = self.client.get_server(server_id)
+        if server is not None:
+            return (int(server.id) >> 22) % self.client.shard_count
+
+    def handle_server_count(self, data):
+        return len(self.client.servers)
+
+    @asyncio.coroutine
+    def handle_change_presence(self, data):
+        game = data.get('game')
+        status = data.get('status')
+        yield from self.client.change_presence(game=Game(**game) if game else None,
+                                               status=try_enum(Status, status) if status else None,
+                                               afk=data.get('afk', False))
+
+class ShardCluster:
+    """Runs the shards of a bot spread over multiple worker processes.
+
+    Every worker process runs an :class:`AutoShardedClient` (or a subclass of
+    it) responsible for a contiguous block of shards. The parent process
+    launches the workers one at a time so that the IDENTIFY rate limit is
+    respected, restarts the workers that die and routes the requests made
+    through :class:`ClusterClient` over a local Unix socket.
+
+    Parameters
+    -----------
+    client_class
+        The :class:`AutoShardedClient` subclass to run in every worker. This
+        must be importable by the worker processes, i.e. defined at the top
+        level of a module.
+    token : str
+        The bot token to log in with.
+    shard_count : Optional[int]
+        The total number of shards. If not given then the recommended number
+        of shards is retrieved from Discord.
+    processes : Optional[int]
+        The number of worker processes. Defaults to the number of CPUs.
+    path : Optional[str]
+        The path of the Unix socket used for communication. Defaults to a
+        file in the temporary directory.
+    \*\*options
+        Keyword arguments passed to the ``client_class`` of every worker.
+    """
+
+    def __init__(self, client_class, token, *, shard_count=None, processes=None, path=None, loop=None, **options):
+        self.loop = asyncio.get_event_loop() if loop is None else loop
+        self.client_class = client_class
+        self.token = token
+        self.shard_count = shard_count
+        self.processes = processes or multiprocessing.cpu_count()
+        self.path = path or os.path.join(tempfile.gettempdir(), 'discord-cluster-{}.sock'.format(os.getpid()))
+        self.options = options
+        self._workers = []
+        self._server = None
+        self._closed = False
+        self._launch_lock = asyncio.Lock(loop=self.loop)
+        self._pending = {}
+        self._nonce = itertools.count()
+
+    @asyncio.coroutine
+    def _get_shard_count(self):
+        http = HTTPClient(loop=self.loop)
+        try:
+            yield from http.static_login(self.token, bot=True)
+            shard_count, gateway = yield from http.get_bot_gateway()
+        finally:
+            yield from http.close()
+        return shard_count
+
+    @asyncio.coroutine
+    def _handle_connection(self, reader, writer):
+        worker = None
+        codec = utils.get_json_codec()
+        while True:
+            line = yield from reader.readline()
+            if not line:
+                break
+
+            msg = codec.loads(line)
+            op = msg.get('op')
+            if op == 'hello':
+                worker = self._workers[msg['d']]
+                worker.writer = writer
+            elif op == 'launched':
+                if worker.launched is not None and not worker.launched.done():
+                    worker.launched.set_result(None)
+            elif op == 'request':
+                compat.create_task(self._route(writer, msg), loop=self.loop)
+            elif op == 'response':
+                future = self._pending.pop(msg['nonce'], None)
+                if future is not None and not future.done():
+                    future.set_result(msg['d'])
+
+        if worker is not None and worker.writer is writer:
+            worker.writer = None
+
+    @asyncio.coroutine
+    def _route(self, writer, msg):
+        futures = []
+        for worker in self._workers:
+            if worker.writer is None:
+                continue
+
+            nonce = next(self._nonce)
+            future = asyncio.Future(loop=self.loop)
+            self._pending[nonce] = future
+            futures.append((nonce, future))
+            _send(worker.writer, { 'op': 'request', 't': msg['t'], 'nonce': nonce, 'd': msg.get('d') })
+
+        if futures:
+            yield from asyncio.wait([f for n, f in futures], timeout=25.0, loop=self.loop)
+
+        results = []
+        for nonce, future in futures:
+            self._pending.pop(nonce, None)
+            if future.done():
+                results.append(future.result())
+            else:
+                future.cancel()
+
+        _send(writer, { 'op': 'response', 'nonce': msg['nonce'], 'd': results })
+
+    @asyncio.coroutine
+    def _launch_worker(self, worker):
+        with (yield from self._launch_lock):
+            if self._closed:
+                return
+
+            worker.launched = asyncio.Future(loop=self.loop)
+            args = (self.client_class, self.token, worker.id, worker.shard_ids,
+                    self.shard_count, self.path, self.options)
+            worker.process = multiprocessing.Process(target=_run_worker, args=args, daemon=True)
+            worker.process.start()
+            log.info('Started worker {0.id} with shards {0.shard_ids}.'.format(worker))
+
+            # every shard takes at least 5 seconds to IDENTIFY
+            timeout = len(worker.shard_ids) * 5.0 + 60.0
+            try:
+                yield from asyncio.wait_for(worker.launched, timeout=timeout, loop=self.loop)
+            except asyncio.TimeoutError:
+                log.warning('Timed out waiting for worker {} to launch its shards.'.format(worker.id))
+
+            # leave room for the IDENTIFY of the previous block
+            yield from asyncio.sleep(5.0, loop=self.loop)
+
+        compat.create_task(self._watch_worker(worker, worker.process), loop=self.loop)
+
+    @asyncio.coroutine
+    def _watch_worker(self, worker, process):
+        yield from self.loop.run_in_executor(None, process.join)
+        if self._closed or worker.process is not process:
+            return
+
+        log.warning('Worker {0.id} exited with code {1}, restarting.'.format(worker, process.exitcode))
+        yield from self._launch_worker(worker)
+
+    @asyncio.coroutine
+    def start(self):
+        """|coro|
+
+        Starts the IPC server and launches every worker process.
+        """
+        if self.shard_count is None:
+            self.shard_count = yield from self._get_shard_count()
+            log.info('Automatically sharding with {} shards.'.format(self.shard_count))
+
+        processes = min(self.processes, self.shard_count)
+        per_worker, extra = divmod(self.shard_count, processes)
+        start = 0
+        for index in range(processes):
+            end = start + per_worker + (index < extra)
+            self._workers.append(_Worker(index, list(range(start, end))))
+            start = end
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+        self._server = yield from asyncio.start_unix_server(self._handle_connection, path=self.path, loop=self.loop)
+        for worker in self._workers:
+            yield from self._launch_worker(worker)
+
+    @asyncio.coroutine
+    def close(self):
+        """|coro|
+
+        Stops every worker process and the IPC server.
+        """
+        if self._closed:
+            return
+
+        self._closed = True
+        for worker in self._workers:
+            if worker.process is not None and worker.process.is_alive():
+                worker.process.terminate()
+
+        if self._server is not None:
+            self._server.close()
+            yield from self._server.wait_closed()
+
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def run(self):
+        """A blocking call that launches the cluster and runs until interrupted."""
+        if not hasattr(asyncio, 'start_unix_server'):
+            raise ClientException('ShardCluster requires Unix domain socket support.')
+
+        try:
+            self.loop.run_until_complete(self.start())
+            self.loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.loop.run_until_complete(self.close())
+            self.loop.close()
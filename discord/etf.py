@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+"""
+The MIT License (MIT)
+
+Copyright (c) 2015-2016 Rapptz
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+# Decodes and encodes the Erlang External Term Format used by the gateway
+# when connecting with encoding=etf. This needs erlpack, a pure Python
+# decoder would make the gateway several times slower than JSON.
+#
+# Discord sends snowflakes as integers when using ETF. The rest of the
+# library expects snowflakes to be strings like in JSON, so integers that
+# do not fit in 32 bits (which are only ever snowflakes) are decoded as
+# strings.
+
+from .errors import DiscordException
+
+try:
+    import erlpack
+except ImportError:
+    erlpack = None
+else:
+    # binaries are decoded as str rather than bytes
+    _decoder = erlpack.ErlangTermDecoder(encoding='utf-8')
+
+__all__ = [ 'ETFError', 'dumps', 'loads' ]
+
+FORMAT_VERSION = 131
+
+class ETFError(DiscordException):
+    """Exception that's thrown when a term can not be encoded or decoded."""
+    pass
+
+def _snowflakes(obj):
+    cls = type(obj)
+    if cls is dict:
+        return { key: _snowflakes(value) for key, value in obj.items() }
+    if cls is list:
+        return [_snowflakes(value) for value in obj]
+    if cls is int and obj >= 2 ** 32:
+        return str(obj)
+    return obj
+
+def loads(data):
+    """Decodes a term in the External Term Format with erlpack.
+
+    Parameters
+    -----------
+    data : bytes
+        The encoded term, starting with the format version.
+
+    Raises
+    -------
+    ETFError
+        The data is not a valid term.
+    """
+    if not data or data[0] != FORMAT_VERSION:
+        raise ETFError('unknown format version')
+
+    try:
+        return _snowflakes(_decoder.loads(bytes(data)))
+    except Exception as e:
+        raise ETFError('malformed term') from e
+
+def dumps(obj):
+    """Encodes a JSON compatible object in the External Term Format with erlpack.
+
+    Strings are encoded as binaries, which is what Discord expects
+    snowflakes and keys to be sent as.
+
+    Raises
+    -------
+    ETFError
+        The object contains something that can not be encoded.
+    """
+    try:
+        return erlpack.pack(obj)
+    except Exception as e:
+        raise ETFError('can not encode the object') from e
@@ -29,6 +29,7 @@ import asyncio
 import re
 import inspect
 
+from discord.server import _find_member_named
 from .errors import BadArgument, NoPrivateMessage
 
 __all__ = [ 'Converter', 'MemberConverter', 'UserConverter',
@@ -77,6 +78,19 @@ class IDConverter(Converter):
         return self._id_regex.match(self.argument)
 
 class MemberConverter(IDConverter):
+    def _might_not_be_cached(self, server):
+        # the member cache policy drops members even from chunked servers
+        return not server.chunked or self.ctx.bot.connection.member_cache_policy is not None
+
+    @asyncio.coroutine
+    def _query(self, server, **kwargs):
+        # asks Discord for members that might just not be cached
+        try:
+            return (yield from self.ctx.bot.query_members(server, **kwargs))
+        except asyncio.TimeoutError:
+            return []
+
+    @asyncio.coroutine
     def convert(self):
         message = self.ctx.message
         bot = self.ctx.bot
@@ -87,12 +101,23 @@ class MemberConverter(IDConverter):
             # not a mention...
             if server:
                 result = server.get_member_named(self.argument)
+                if result is None and self._might_not_be_cached(server):
+                    name = self.argument
+                    if len(name) > 5 and name[-5] == '#':
+                        name = name[:-5]
+
+                    # the member cache policy might not keep them cached
+                    members = yield from self._query(server, query=name, limit=100)
+                    result = _find_member_named(members, self.argument)
             else:
                 result = _get_from_servers(bot, 'get_member_named', self.argument)
         else:
             user_id = match.group(1)
             if server:
                 result = server.get_member(user_id)
+                if result is None and self._might_not_be_cached(server):
+                    members = yield from self._query(server, user_ids=[user_id])
+                    result = discord.utils.get(members, id=user_id)
             else:
                 result = _get_from_servers(bot, 'get_member', user_id)
 
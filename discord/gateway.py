@@ -29,20 +29,20 @@ import time
 import websockets
 import asyncio
 import aiohttp
-from . import utils, compat
+from . import utils, compat, etf
 from .enums import Status, try_enum
 from .game import Game
 from .errors import GatewayNotFound, ConnectionClosed, InvalidArgument
 import logging
 import zlib, time, json
-from collections import namedtuple
-import threading
+from collections import namedtuple, deque
 import struct
+import re
 
 log = logging.getLogger(__name__)
 
 __all__ = [ 'DiscordWebSocket', 'KeepAliveHandler', 'VoiceKeepAliveHandler',
-            'DiscordVoiceWebSocket', 'ResumeWebSocket' ]
+            'DiscordVoiceWebSocket', 'ResumeWebSocket', 'IdentifyScheduler' ]
 
 class ResumeWebSocket(Exception):
     """Signals to initialise via RESUME opcode instead of IDENTIFY."""
@@ -50,6 +50,41 @@ class ResumeWebSocket(Exception):
 
 EventListener = namedtuple('EventListener', 'predicate event result future')
 
+# the trailing bytes of every message when using zlib-stream transport compression
+ZLIB_SUFFIX = b'\x00\x00\xff\xff'
+
+# used to peek at a DISPATCH before decoding it. Discord sends the t, s and op
+# keys before the d key so only a small part of the frame has to be looked at.
+_PEEK_SIZE = 128
+_PEEK_EVENT = re.compile(r'"t"\s*:\s*"([A-Z_]+)"')
+_PEEK_SEQUENCE = re.compile(r'"s"\s*:\s*(\d+)')
+
+# used to find the guild ID among the top level keys of the payload. Strings are
+# matched whole so brackets inside them are not counted, and keys end with a colon.
+# Only the start of the payload is looked at, if the ID is not in there the frame
+# is decoded and filtered afterwards.
+_PEEK_GUILD_SIZE = 4096
+_PEEK_TOKEN = re.compile(r'"((?:[^"\\]|\\.)*)"(\s*:)?|[{}\[\]]')
+_PEEK_SNOWFLAKE = re.compile(r'\s*"(\d+)"')
+
+# messages this small are decoded by the reader task to check for a
+# HEARTBEAT_ACK, every DISPATCH is larger.
+_ACK_SIZE = 64
+
+_etf_codec = utils.JSONCodec('etf', etf.dumps, etf.loads)
+
+def _get_codec(client):
+    # the HTTP API always uses JSON, only the gateway can use ETF
+    if client._encoding == 'etf':
+        return _etf_codec
+    return client.http._json
+
+# events that are never filtered as the client cannot work without them
+_UNFILTERED_EVENTS = frozenset(('READY', 'RESUMED'))
+
+# events where the guild ID is under the id key rather than guild_id
+_GUILD_EVENTS = frozenset(('GUILD_CREATE', 'GUILD_UPDATE', 'GUILD_DELETE', 'GUILD_SYNC'))
+
 @asyncio.coroutine
 def _ensure_coroutine_connect(gateway, *, loop, klass):
     # In 3.5+ websockets.connect does not return a coroutine, but an awaitable.
@@ -60,62 +95,195 @@ def _ensure_coroutine_connect(gateway, *, loop, klass):
     ws = yield from websockets.connect(gateway, loop=loop, klass=klass)
     return ws
 
-class KeepAliveHandler(threading.Thread):
-    def __init__(self, *args, **kwargs):
-        ws = kwargs.pop('ws', None)
-        interval = kwargs.pop('interval', None)
-        threading.Thread.__init__(self, *args, **kwargs)
+class IdentifyScheduler:
+    """Queues the IDENTIFY payloads of every shard of a client.
+
+    Discord only allows a single IDENTIFY per ``interval`` seconds for
+    each of the ``max_concurrency`` rate limit buckets. A shard belongs
+    to the bucket ``shard_id % max_concurrency``. Shards in different
+    buckets may IDENTIFY at the same time.
+
+    This is for internal use only.
+    """
+
+    def __init__(self, *, max_concurrency=1, interval=5.0, loop):
+        self.loop = loop
+        self.max_concurrency = max_concurrency
+        self.interval = interval
+        self._locks = {}
+        self._last_identify = {}
+
+    @asyncio.coroutine
+    def wait(self, shard_id):
+        """Waits until the shard is allowed to send its IDENTIFY."""
+        bucket = (shard_id or 0) % self.max_concurrency
+        lock = self._locks.get(bucket)
+        if lock is None:
+            lock = self._locks[bucket] = asyncio.Lock(loop=self.loop)
+
+        with (yield from lock):
+            last = self._last_identify.get(bucket)
+            if last is not None:
+                delay = last + self.interval - self.loop.time()
+                if delay > 0:
+                    log.info('Shard ID {} is waiting {:.2f} seconds to IDENTIFY.'.format(shard_id, delay))
+                    yield from asyncio.sleep(delay, loop=self.loop)
+            self._last_identify[bucket] = self.loop.time()
+
+class GatewayRatelimiter:
+    """Keeps a websocket under the gateway's limit of ``count`` sends per ``per`` seconds.
+
+    The send times within the last ``per`` seconds are remembered, so the
+    limit holds for any window rather than only for fixed ones. Regular
+    sends leave ``reserved`` slots untouched so that the priority lane
+    (heartbeats, IDENTIFY and RESUME) never has to wait behind them.
+
+    Attributes
+    -----------
+    pending : int
+        The number of regular sends currently waiting for a slot.
+    coalesced : int
+        The number of presence updates that were replaced by a newer one
+        before they could be sent.
+    """
+
+    def __init__(self, count=120, per=60.0, reserved=5, *, loop):
+        self.loop = loop
+        self.count = count
+        self.per = per
+        self.reserved = reserved
+        self.pending = 0
+        self.coalesced = 0
+        self._sent = deque()
+        self._lock = asyncio.Lock(loop=loop)
+
+    @property
+    def remaining(self):
+        """int: The number of sends left in the current window, including the reserved ones."""
+        self._expire(self.loop.time())
+        return self.count - len(self._sent)
+
+    def _expire(self, now):
+        sent = self._sent
+        while sent and sent[0] <= now - self.per:
+            sent.popleft()
+
+    def _reserve(self, priority):
+        now = self.loop.time()
+        self._expire(now)
+        limit = self.count if priority else self.count - self.reserved
+        if len(self._sent) < limit:
+            self._sent.append(now)
+            return None
+
+        # the slot frees up once enough of the oldest sends expire
+        return self._sent[len(self._sent) - limit] + self.per - now
+
+    @asyncio.coroutine
+    def acquire(self, *, priority=False):
+        """Waits until a send is allowed and claims its slot."""
+        if priority:
+            delay = self._reserve(True)
+            while delay is not None:
+                yield from asyncio.sleep(delay, loop=self.loop)
+                delay = self._reserve(True)
+            return
+
+        self.pending += 1
+        try:
+            # the lock keeps regular sends in FIFO order
+            with (yield from self._lock):
+                delay = self._reserve(False)
+                while delay is not None:
+                    log.info('Gateway send rate limit reached, waiting {:.2f} seconds.'.format(delay))
+                    yield from asyncio.sleep(delay, loop=self.loop)
+                    delay = self._reserve(False)
+        finally:
+            self.pending -= 1
+
+class KeepAliveHandler:
+    """Sends the heartbeats of a websocket from a task running on its loop.
+
+    The round trip between a HEARTBEAT and its HEARTBEAT_ACK is recorded
+    in :attr:`latency` and the most recent ones in :attr:`latencies`. If
+    no HEARTBEAT_ACK arrived by the time the next HEARTBEAT is due then
+    the connection is considered a zombie and is closed so that the
+    client reconnects through RESUME.
+    """
+
+    # the number of latency samples kept around for the histogram
+    history = 100
+
+    # whether a missing HEARTBEAT_ACK closes the connection
+    check_acks = True
+
+    def __init__(self, *, ws, interval):
         self.ws = ws
+        self.loop = ws.loop
         self.interval = interval
-        self.daemon = True
         self.msg = 'Keeping websocket alive with sequence {0[d]}'
-        self._stop_ev = threading.Event()
-        self._last_ack = time.time()
+        self._task = None
+        # True from sending a HEARTBEAT until its HEARTBEAT_ACK arrives
+        self._awaiting_ack = False
+        self._last_send = self.loop.time()
+        self.latency = float('inf')
+        self.latencies = deque(maxlen=self.history)
+
+    def start(self):
+        self._task = compat.create_task(self.run(), loop=self.loop)
 
+    @asyncio.coroutine
     def run(self):
-        while not self._stop_ev.wait(self.interval):
-            if self._last_ack + 2 * self.interval < time.time():
-                log.warn("We have stopped responding to the gateway.")
-                coro = self.ws.close(1001)
-                f = compat.run_coroutine_threadsafe(coro, loop=self.ws.loop)
+        while True:
+            yield from asyncio.sleep(self.interval, loop=self.loop)
+            if self.check_acks and self._awaiting_ack and not self.ws._receive_blocked:
+                log.warn("We have stopped responding to the gateway. Closing to RESUME.")
+                # closing waits for the close_connection that stops us,
+                # so it has to happen outside of this task.
+                compat.create_task(self.ws.close(4000), loop=self.loop)
+                return
 
-                try:
-                    f.result()
-                except:
-                    pass
-                finally:
-                    self.stop()
-                    return
-
-            data = self.get_payload()
-            log.debug(self.msg.format(data))
-            coro = self.ws.send_as_json(data)
-            f = compat.run_coroutine_threadsafe(coro, loop=self.ws.loop)
             try:
-                # block until sending is complete
-                f.result()
+                yield from self.beat()
             except Exception:
-                self.stop()
+                return
+
+    @asyncio.coroutine
+    def beat(self):
+        """Sends a HEARTBEAT, either periodically or because the gateway asked for one."""
+        data = self.get_payload()
+        log.debug(self.msg.format(data))
+
+        # set before sending as the ACK could be processed before we resume
+        self._last_send = self.loop.time()
+        self._awaiting_ack = True
+        yield from self.ws.send_as_json(data)
 
     def get_payload(self):
         return {
             'op': self.ws.HEARTBEAT,
-            'd': self.ws._connection.sequence
+            'd': self.ws.sequence
         }
 
     def stop(self):
-        self._stop_ev.set()
+        if self._task is not None:
+            self._task.cancel()
 
     def ack(self):
-        self._last_ack = time.time()
+        ack_time = self.loop.time()
+        self._awaiting_ack = False
+        self.latency = ack_time - self._last_send
+        self.latencies.append(self.latency)
 
 class VoiceKeepAliveHandler(KeepAliveHandler):
+    # the voice gateway does not acknowledge heartbeats
+    check_acks = False
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.msg = 'Keeping voice websocket alive with timestamp {0[d]}'
 
     def get_payload(self):
-        self.ack()
         return {
             'op': self.ws.HEARTBEAT,
             'd': int(time.time() * 1000)
@@ -162,6 +330,18 @@ class DiscordWebSocket(websockets.client.WebSocketClientProtocol):
         The gateway we are currently connected to.
     token
         The authentication token for discord.
+    shard_id
+        The shard ID this websocket is connected as. None if not sharded.
+    sequence
+        The last sequence number received. Used for heartbeats and RESUME.
+    session_id
+        The session ID received in READY. Used for RESUME.
+    event_lag
+        The number of seconds the last processed message waited in the
+        receive queue. The time it spent in the websockets library's own
+        buffer beforehand is not known, so with ``receive_queue_full`` set
+        to ``'block'`` this under-reports once the queue is full. See also
+        :attr:`receive_queue_depth`.
     """
 
     DISPATCH           = 0
@@ -183,34 +363,86 @@ class DiscordWebSocket(websockets.client.WebSocketClientProtocol):
         self.max_size = None
         # an empty dispatcher to prevent crashes
         self._dispatch = lambda *args: None
-        # generic event listeners
-        self._dispatch_listeners = []
+        # generic event listeners, keyed by event name
+        self._dispatch_listeners = {}
         # the keep alive
         self._keep_alive = None
+        # session state for heartbeats and RESUME
+        self.sequence = None
+        self.session_id = None
+        # zlib-stream transport compression state, None if disabled
+        self._zlib = None
+        self._buffer = bytearray()
+        # the payload encoding and the codec for it, the JSON
+        # codec is shared with the HTTP client.
+        self._encoding = 'json'
+        self._codec = utils.get_json_codec()
+        # spaces out the IDENTIFY payloads of every shard
+        self._identify_scheduler = None
+        # events and guilds to drop before they are decoded
+        self._ignored_events = frozenset()
+        self._guild_allowlist = None
+        # outbound rate limiting and the latest presence waiting to be sent
+        self._rate_limiter = GatewayRatelimiter(loop=self.loop)
+        self._pending_presence = None
+        # writes every received message to a recording, None if disabled
+        self._recorder = None
+        # the messages received by the reader task waiting to be processed
+        self._receive_queue = None
+        # True while the reader task waits for room in the full queue
+        self._receive_blocked = False
+        self._receive_queue_size = 1000
+        self._receive_queue_full = 'block'
+        self._reader = None
+        self.event_lag = 0.0
+        # payloads of at least this many bytes are decoded in an executor
+        self._offload_threshold = None
+        # the events held back while a job builds their server, keyed by
+        # the IDs of the server and its channels
+        self._backlogs = {}
+        # the tasks running the jobs
+        self._jobs = set()
 
     @classmethod
     @asyncio.coroutine
-    def from_client(cls, client, *, resume=False):
+    def from_client(cls, client, *, shard_id=None, session=None, sequence=None, resume=False):
         """Creates a main websocket for Discord from a :class:`Client`.
 
         This is for internal use only.
         """
-        gateway = yield from client.http.get_gateway()
+        use_zlib = client._compress == 'zlib-stream'
+        gateway = yield from client.http.get_gateway(zlib=use_zlib, encoding=client._encoding)
         try:
             ws = yield from asyncio.wait_for(
                     _ensure_coroutine_connect(gateway, loop=client.loop, klass=cls),
                     timeout=60, loop=client.loop)
         except asyncio.TimeoutError:
             log.warn('timed out waiting for client connect')
-            return (yield from cls.from_client(client, resume=resume))
+            return (yield from cls.from_client(client, shard_id=shard_id, session=session,
+                                               sequence=sequence, resume=resume))
 
         # dynamically add attributes needed
         ws.token = client.http.token
         ws._connection = client.connection
         ws._dispatch = client.dispatch
         ws.gateway = gateway
-        ws.shard_id = client.shard_id
+        ws.shard_id = client.shard_id if shard_id is None else shard_id
         ws.shard_count = client.shard_count
+        ws.session_id = session
+        ws.sequence = sequence
+        ws._encoding = client._encoding
+        ws._codec = _get_codec(client)
+        ws._identify_scheduler = client._identify_scheduler
+        ws._ignored_events = client._ignored_events
+        ws._guild_allowlist = client._guild_allowlist
+        ws._recorder = client._recorder
+        ws._receive_queue_size = client._receive_queue_size
+        ws._receive_queue_full = client._receive_queue_full
+        ws._offload_threshold = client._offload_threshold
+
+        if use_zlib:
+            # the inflate context lives as long as the connection does
+            ws._zlib = zlib.decompressobj()
 
         client.connection._update_references(ws)
 
@@ -222,7 +454,8 @@ class DiscordWebSocket(websockets.client.WebSocketClientProtocol):
         except asyncio.TimeoutError:
             log.warn("timed out waiting for client HELLO")
             yield from ws.close(1001)
-            return (yield from cls.from_client(client, resume=resume))
+            return (yield from cls.from_client(client, shard_id=shard_id, session=session,
+                                               sequence=sequence, resume=resume))
 
         if not resume:
             yield from ws.identify()
@@ -236,7 +469,7 @@ class DiscordWebSocket(websockets.client.WebSocketClientProtocol):
         except websockets.exceptions.ConnectionClosed:
             # ws got closed so let's just do a regular IDENTIFY connect.
             log.warn('RESUME failure.')
-            return (yield from cls.from_client(client))
+            return (yield from cls.from_client(client, shard_id=shard_id))
         else:
             return ws
 
@@ -262,9 +495,26 @@ class DiscordWebSocket(websockets.client.WebSocketClientProtocol):
 
         future = asyncio.Future(loop=self.loop)
         entry = EventListener(event=event, predicate=predicate, result=result, future=future)
-        self._dispatch_listeners.append(entry)
+        self._dispatch_listeners.setdefault(event, []).append(entry)
+
+        # the listener is removed as soon as the future is done, including
+        # when it is cancelled or times out, rather than on the next event.
+        future.add_done_callback(lambda f: self._remove_listener(entry))
         return future
 
+    def _remove_listener(self, entry):
+        listeners = self._dispatch_listeners.get(entry.event)
+        if listeners is None:
+            return
+
+        try:
+            listeners.remove(entry)
+        except ValueError:
+            pass
+
+        if not listeners:
+            del self._dispatch_listeners[entry.event]
+
     @asyncio.coroutine
     def identify(self):
         """Sends the IDENTIFY packet."""
@@ -279,7 +529,8 @@ class DiscordWebSocket(websockets.client.WebSocketClientProtocol):
                     '$referrer': '',
                     '$referring_domain': ''
                 },
-                'compress': True,
+                # per message compression is only supported with JSON
+                'compress': self._zlib is None and self._encoding == 'json',
                 'large_threshold': 250,
                 'v': 3
             }
@@ -291,17 +542,27 @@ class DiscordWebSocket(websockets.client.WebSocketClientProtocol):
         if self.shard_id is not None and self.shard_count is not None:
             payload['d']['shard'] = [self.shard_id, self.shard_count]
 
+        if self._identify_scheduler is not None:
+            yield from self._identify_scheduler.wait(self.shard_id)
+
         yield from self.send_as_json(payload)
 
+    @asyncio.coroutine
+    def _reidentify(self):
+        try:
+            yield from self.identify()
+        except Exception:
+            # a closed connection is also noticed by poll_event
+            log.exception('Shard ID {} failed to IDENTIFY again.'.format(self.shard_id))
+
     @asyncio.coroutine
     def resume(self):
         """Sends the RESUME packet."""
-        state = self._connection
         payload = {
             'op': self.RESUME,
             'd': {
-                'seq': state.sequence,
-                'session_id': state.session_id,
+                'seq': self.sequence,
+                'session_id': self.session_id,
                 'token': self.token
             }
         }
@@ -310,23 +571,76 @@ class DiscordWebSocket(websockets.client.WebSocketClientProtocol):
 
     @asyncio.coroutine
     def received_message(self, msg):
+        msg = yield from self._inflate(msg)
+        if msg is not None:
+            yield from self._process_message(msg)
+
+    @asyncio.coroutine
+    def _inflate(self, msg):
+        # returns the decompressed message, or None if it continues in the next frame
         self._dispatch('socket_raw_receive', msg)
 
         if isinstance(msg, bytes):
-            msg = zlib.decompress(msg, 15, 10490000) # This is 10 MiB
-            msg = msg.decode('utf-8')
+            if self._zlib is not None:
+                # zlib-stream messages may span multiple frames so we
+                # buffer them until we receive the Z_SYNC_FLUSH suffix
+                self._buffer.extend(msg)
+                if len(msg) < 4 or msg[-4:] != ZLIB_SUFFIX:
+                    return None
+
+                if self._should_offload(self._buffer):
+                    # the inflate context is only used by one message at a
+                    # time since the messages are processed one by one.
+                    msg = yield from self.loop.run_in_executor(None, self._zlib.decompress, self._buffer)
+                else:
+                    msg = self._zlib.decompress(self._buffer)
+                del self._buffer[:]
+            elif self._encoding == 'json':
+                if self._should_offload(msg):
+                    msg = yield from self.loop.run_in_executor(None, zlib.decompress, msg, 15, 10490000)
+                else:
+                    msg = zlib.decompress(msg, 15, 10490000) # This is 10 MiB
+
+        return msg
+
+    def _received_ack(self, msg):
+        # HEARTBEAT_ACK is handled by the reader task as soon as it arrives,
+        # behind the queued messages it could miss the next heartbeat.
+        if len(msg) > _ACK_SIZE or self._keep_alive is None:
+            return False
+
+        data = self._codec.loads(msg)
+        if not isinstance(data, dict) or data.get('op') != self.HEARTBEAT_ACK:
+            return False
+
+        if self._recorder is not None:
+            self._recorder.record(self.shard_id, msg)
+
+        self._dispatch('socket_response', data)
+        self._keep_alive.ack()
+        return True
 
-        msg = json.loads(msg)
-        state = self._connection
+    @asyncio.coroutine
+    def _process_message(self, msg):
+        if self._recorder is not None:
+            self._recorder.record(self.shard_id, msg)
+
+        filtering = self._ignored_events or self._guild_allowlist is not None
+        if filtering and self._encoding == 'json' and self._filter_raw(msg):
+            return
+
+        # the codec decodes bytes directly so there's no need to decode to str first.
+        # Decoding holds the GIL so unlike inflating it gains nothing from a thread.
+        msg = self._codec.loads(msg)
 
-        log.debug('WebSocket Event: {}'.format(msg))
+        log.debug('WebSocket Event: %s', msg)
         self._dispatch('socket_response', msg)
 
         op = msg.get('op')
         data = msg.get('d')
         seq = msg.get('s')
         if seq is not None:
-            state.sequence = seq
+            self.sequence = seq
 
         if op == self.RECONNECT:
             # "reconnect" can only be handled by the Client
@@ -334,15 +648,14 @@ class DiscordWebSocket(websockets.client.WebSocketClientProtocol):
             # internal exception signalling to reconnect.
             log.info('Received RECONNECT opcode.')
             yield from self.close()
-            raise ResumeWebsocket()
+            raise ResumeWebSocket()
 
         if op == self.HEARTBEAT_ACK:
             self._keep_alive.ack()
             return
 
         if op == self.HEARTBEAT:
-            beat = self._keep_alive.get_payload()
-            yield from self.send_as_json(beat)
+            yield from self._keep_alive.beat()
             return
 
         if op == self.HELLO:
@@ -357,10 +670,12 @@ class DiscordWebSocket(websockets.client.WebSocketClientProtocol):
                 yield from self.close()
                 raise ResumeWebSocket()
 
-            state.sequence = None
-            state.session_id = None
+            self.sequence = None
+            self.session_id = None
 
-            yield from self.identify()
+            # the IDENTIFY might wait for other shards for a while, the
+            # messages received in the meantime are still processed.
+            compat.create_task(self._reidentify(), loop=self.loop)
             return
 
         if op != self.DISPATCH:
@@ -371,10 +686,33 @@ class DiscordWebSocket(websockets.client.WebSocketClientProtocol):
         is_ready = event == 'READY'
 
         if is_ready:
-            state.clear()
-            state.sequence = msg['s']
-            state.session_id = data['session_id']
+            self.sequence = msg['s']
+            self.session_id = data['session_id']
+            data['__shard_id__'] = self.shard_id
+            if self._guild_allowlist is not None:
+                data['guilds'] = [g for g in data.get('guilds', []) if g['id'] in self._guild_allowlist]
+            # the servers the running jobs build and the events they hold
+            # back belong to the old session, READY replaces them.
+            self._cancel_jobs()
+        elif event == 'RESUMED':
+            data['__shard_id__'] = self.shard_id
+        elif event in self._ignored_events or not self._is_allowed(event, data):
+            # the peek could not decide so drop it after decoding instead. It
+            # still resolves the wait_for listeners, e.g. of a voice connect.
+            self._resolve_listeners(event, data)
+            return
+
+        backlog = self._get_backlog(event, data)
+        if backlog is not None:
+            # the server is being built by a job, its events wait for it
+            backlog.append((event, data))
+            return
+
+        self._handle_dispatch(event, data)
 
+    def _handle_dispatch(self, event, data):
+        # returns True if the event started a job that holds back
+        # the events of its server until it is done.
         parser = 'parse_' + event.lower()
 
         try:
@@ -382,64 +720,324 @@ class DiscordWebSocket(websockets.client.WebSocketClientProtocol):
         except AttributeError:
             log.info('Unhandled event {}'.format(event))
         else:
-            func(data)
+            result = func(data)
+            if asyncio.iscoroutine(result):
+                # a bulky payload processed in time slices. The events of
+                # the other servers keep being processed in the meantime.
+                self._start_job(result, event, data)
+                return True
+
+        self._resolve_listeners(event, data)
+        return False
+
+    def _get_backlog(self, event, data):
+        if not self._backlogs or event in _UNFILTERED_EVENTS or not isinstance(data, dict):
+            return None
+
+        guild_id = data.get('id') if event in _GUILD_EVENTS else data.get('guild_id')
+        if guild_id is None:
+            # events like MESSAGE_CREATE only refer to the channel
+            return self._backlogs.get(data.get('channel_id'))
+        return self._backlogs.get(guild_id)
+
+    def _start_job(self, job, event, data):
+        guild_id = data.get('id') if event in _GUILD_EVENTS else data.get('guild_id')
+        keys = { guild_id }
+        keys.update(c['id'] for c in data.get('channels', ()))
+        server = self._connection._get_server(guild_id)
+        if server is not None:
+            keys.update(c.id for c in server.channels)
+
+        backlog = deque()
+        for key in keys:
+            self._backlogs[key] = backlog
+        task = compat.create_task(self._run_job(job, event, data, keys, backlog), loop=self.loop)
+        self._jobs.add(task)
+        task.add_done_callback(self._jobs.discard)
 
-        # remove the dispatched listeners
-        removed = []
-        for index, entry in enumerate(self._dispatch_listeners):
-            if entry.event != event:
-                continue
+    @asyncio.coroutine
+    def _run_job(self, job, event, data, keys, backlog):
+        try:
+            yield from job
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception('Failed to process {} in the background.'.format(event))
+        else:
+            self._resolve_listeners(event, data)
 
-            future = entry.future
-            if future.cancelled():
-                removed.append(index)
-                continue
+        for key in keys:
+            del self._backlogs[key]
 
+        # replay the held back events in order. If one of them starts
+        # another job the remaining ones are held back by that job.
+        while backlog:
+            event, data = backlog.popleft()
             try:
-                valid = entry.predicate(data)
-            except Exception as e:
-                future.set_exception(e)
-                removed.append(index)
-            else:
-                if valid:
-                    ret = data if entry.result is None else entry.result(data)
-                    future.set_result(ret)
-                    removed.append(index)
+                started = self._handle_dispatch(event, data)
+            except Exception:
+                log.exception('Failed to process the held back {}.'.format(event))
+                continue
+
+            if started:
+                self._get_backlog(event, data).extend(backlog)
+                return
 
-        for index in reversed(removed):
-            del self._dispatch_listeners[index]
+    def _cancel_jobs(self):
+        # the jobs are cancelled at their next slice, so they
+        # never add the server they were building.
+        for task in self._jobs:
+            task.cancel()
+        if self._backlogs:
+            log.info('Shard ID {} dropped the events held back by {} jobs.'.format(self.shard_id, len(self._jobs)))
+        self._jobs = set()
+        self._backlogs = {}
+
+    @asyncio.coroutine
+    def _drain_backlogs(self):
+        # waits for the running jobs and the events they replay. Called
+        # before the websocket is replaced, so that after a RESUME the
+        # held back events are still processed before the new ones.
+        while self._jobs:
+            yield from asyncio.wait(list(self._jobs), loop=self.loop)
+
+    def _resolve_listeners(self, event, data):
+        # resolve the listeners waiting for this event, the done
+        # callback of their future takes care of removing them.
+        listeners = self._dispatch_listeners.get(event)
+        if listeners:
+            for entry in tuple(listeners):
+                future = entry.future
+                if future.done():
+                    continue
+
+                try:
+                    valid = entry.predicate(data)
+                except Exception as e:
+                    future.set_exception(e)
+                else:
+                    if valid:
+                        ret = data if entry.result is None else entry.result(data)
+                        future.set_result(ret)
+
+    def _should_offload(self, payload):
+        return self._offload_threshold is not None and len(payload) >= self._offload_threshold
+
+    def _is_allowed(self, event, data):
+        if self._guild_allowlist is None or event in _UNFILTERED_EVENTS or not isinstance(data, dict):
+            return True
+
+        guild_id = data.get('id') if event in _GUILD_EVENTS else data.get('guild_id')
+        return guild_id is None or guild_id in self._guild_allowlist
+
+    def _filter_raw(self, msg):
+        """Checks if a raw frame can be dropped without decoding it.
+
+        Returns ``True`` if the frame was dropped. The sequence is still
+        updated so that heartbeats and RESUME keep working.
+        """
+        head = msg[:_PEEK_SIZE]
+        if isinstance(head, (bytes, bytearray)):
+            head = head.decode('utf-8', 'ignore')
+
+        # only look at the keys that come before the payload
+        end = head.find('"d"')
+        if end == -1:
+            return False
+
+        head = head[:end]
+        event = _PEEK_EVENT.search(head)
+        seq = _PEEK_SEQUENCE.search(head)
+        if event is None or seq is None:
+            return False
+
+        event = event.group(1)
+        if event in _UNFILTERED_EVENTS or event in self._dispatch_listeners:
+            # the listeners need the decoded payload to check their predicate
+            return False
+
+        if event not in self._ignored_events:
+            if self._guild_allowlist is None:
+                return False
+
+            key = 'id' if event in _GUILD_EVENTS else 'guild_id'
+            guild_id = self._peek_guild_id(msg, end, key)
+            if guild_id is None:
+                return False
+
+            if guild_id in self._guild_allowlist:
+                return False
+
+        self.sequence = int(seq.group(1))
+        return True
+
+    def _peek_guild_id(self, msg, start, key):
+        payload = msg[start:start + _PEEK_GUILD_SIZE]
+        if isinstance(payload, (bytes, bytearray)):
+            payload = payload.decode('utf-8', 'ignore')
+
+        # the first token is the "d" key itself
+        depth = 0
+        for token in _PEEK_TOKEN.finditer(payload):
+            char = token.group(0)[0]
+            if char in '{[':
+                depth += 1
+            elif char in '}]':
+                depth -= 1
+                if depth == 0:
+                    return None
+            elif depth == 1 and token.group(2) and token.group(1) == key:
+                value = _PEEK_SNOWFLAKE.match(payload, token.end())
+                return value and value.group(1)
+
+        return None
+
+    @property
+    def latency(self):
+        """float: Measures latency between a HEARTBEAT and a HEARTBEAT_ACK in seconds."""
+        heartbeat = self._keep_alive
+        return float('inf') if heartbeat is None else heartbeat.latency
+
+    def latency_histogram(self, buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)):
+        """Bins the most recent heartbeat latencies.
+
+        Parameters
+        -----------
+        buckets : sequence of float
+            The ascending upper bounds of the buckets, in seconds. A final
+            bucket with an infinite upper bound is always added.
+
+        Returns
+        --------
+        list
+            A list of ``(upper_bound, count)`` tuples.
+        """
+        bounds = list(buckets) + [float('inf')]
+        counts = [0] * len(bounds)
+        samples = self._keep_alive.latencies if self._keep_alive is not None else ()
+        for latency in samples:
+            for index, bound in enumerate(bounds):
+                if latency <= bound:
+                    counts[index] += 1
+                    break
+        return list(zip(bounds, counts))
 
     def _can_handle_close(self, code):
         return code not in (1000, 4004, 4010, 4011)
 
+    @property
+    def receive_queue_depth(self):
+        """int: The number of received messages waiting to be processed."""
+        return 0 if self._receive_queue is None else self._receive_queue.qsize()
+
+    @asyncio.coroutine
+    def _read_messages(self):
+        # the websockets library reads the socket in its own task, this
+        # moves the messages into the bounded queue as soon as they arrive
+        # so the time they wait is known, and answers HEARTBEAT_ACK right
+        # away. poll_event does the rest.
+        queue = self._receive_queue
+        try:
+            while True:
+                msg = yield from self.recv()
+                received_at = self.loop.time()
+                msg = yield from self._inflate(msg)
+                if msg is None or self._received_ack(msg):
+                    continue
+
+                if queue.full():
+                    if self._receive_queue_full == 'reconnect':
+                        # the unprocessed messages are replayed by the RESUME
+                        # since the sequence is only updated when processing.
+                        log.warning('Shard ID {} fell {} messages behind, reconnecting.'.format(self.shard_id,
+                                                                                               queue.qsize()))
+                        while not queue.empty():
+                            queue.get_nowait()
+                        yield from self.close(4000)
+                        continue
+
+                    log.debug('Shard ID {} receive queue is full.'.format(self.shard_id))
+
+                    # the HEARTBEAT_ACK can't be read until there is room,
+                    # so a missing one doesn't mean the connection is dead.
+                    self._receive_blocked = True
+                    try:
+                        yield from queue.put((received_at, msg))
+                    finally:
+                        self._receive_blocked = False
+                    continue
+
+                queue.put_nowait((received_at, msg))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # raised by poll_event once the messages before it are processed,
+            # e.g. ConnectionClosed or a payload that could not be inflated.
+            if queue.full():
+                # poll_event might not take anything anymore so this can't
+                # wait for room. The dropped messages are replayed by a RESUME.
+                log.warning('Shard ID {} dropped {} messages to report {!r}.'.format(self.shard_id,
+                                                                                   queue.qsize(), e))
+                while not queue.empty():
+                    queue.get_nowait()
+            queue.put_nowait((None, e))
+
     @asyncio.coroutine
     def poll_event(self):
         """Polls for a DISPATCH event and handles the general gateway loop.
 
+        Messages are received by a separate reader task and buffered in a
+        bounded queue until they are processed here.
+
         Raises
         ------
         ConnectionClosed
             The websocket connection was terminated for unhandled reasons.
         """
+        if self._reader is None:
+            self._receive_queue = asyncio.Queue(maxsize=self._receive_queue_size, loop=self.loop)
+            self._reader = compat.create_task(self._read_messages(), loop=self.loop)
+
         try:
-            msg = yield from self.recv()
-            yield from self.received_message(msg)
+            received_at, msg = yield from self._receive_queue.get()
+            if received_at is None:
+                raise msg
+
+            self.event_lag = self.loop.time() - received_at
+            yield from self._process_message(msg)
         except websockets.exceptions.ConnectionClosed as e:
+            self._reader.cancel()
             if self._can_handle_close(e.code):
                 log.info('Websocket closed with {0.code} ({0.reason}), attempting a reconnect.'.format(e))
                 raise ResumeWebSocket() from e
             else:
                 raise ConnectionClosed(e) from e
+        except Exception:
+            # the websocket is not polled anymore so nothing would
+            # empty the queue the reader might be waiting on.
+            self._reader.cancel()
+            raise
 
     @asyncio.coroutine
     def send(self, data):
         self._dispatch('socket_raw_send', data)
         yield from super().send(data)
 
+    @property
+    def send_queue_depth(self):
+        """int: The number of payloads waiting for the outbound rate limit."""
+        return self._rate_limiter.pending
+
     @asyncio.coroutine
     def send_as_json(self, data):
+        priority = data.get('op') in (self.HEARTBEAT, self.IDENTIFY, self.RESUME)
+        yield from self._rate_limiter.acquire(priority=priority)
+        yield from self._send_json(data)
+
+    @asyncio.coroutine
+    def _send_json(self, data):
         try:
-            yield from super().send(utils.to_json(data))
+            yield from super().send(self._codec.dumps(data))
         except websockets.exceptions.ConnectionClosed as e:
             if not self._can_handle_close(e.code):
                 raise ConnectionClosed(e) from e
@@ -467,7 +1065,35 @@ class DiscordWebSocket(websockets.client.WebSocketClientProtocol):
             }
         }
 
-        sent = utils.to_json(payload)
+        # a presence update waiting for the rate limit is superseded
+        # by this one so only the latest one ends up being sent. The
+        # sender updates the cache with the presence it actually sent.
+        waiting = self._pending_presence is not None
+        self._pending_presence = (payload, game, status)
+        if waiting:
+            self._rate_limiter.coalesced += 1
+            return
+
+        yield from self._send_pending_presence()
+
+    @asyncio.coroutine
+    def _send_pending_presence(self):
+        entry = self._pending_presence
+        try:
+            yield from self._rate_limiter.acquire()
+        except asyncio.CancelledError:
+            if self._pending_presence is entry:
+                self._pending_presence = None
+            else:
+                # a newer presence was coalesced into this one and its caller
+                # already returned, so a task of its own has to send it.
+                compat.create_task(self._send_pending_presence(), loop=self.loop)
+            raise
+
+        payload, game, status = self._pending_presence
+        self._pending_presence = None
+
+        sent = self._codec.dumps(payload)
         log.debug('Sending "{}" to change status'.format(sent))
         yield from self.send(sent)
 
@@ -26,7 +26,6 @@ DEALINGS IN THE SOFTWARE.
 
 import aiohttp
 import asyncio
-import json
 import sys
 import logging
 import weakref
@@ -39,10 +38,12 @@ from .errors import HTTPException, Forbidden, NotFound, LoginFailure, GatewayNot
 from . import __version__, utils
 
 @asyncio.coroutine
-def json_or_text(response):
-    text = yield from response.text(encoding='utf-8')
+def json_or_text(response, codec=None):
     if response.headers['content-type'] == 'application/json':
-        return json.loads(text)
+        # decode straight from the body to avoid building an intermediate str
+        data = yield from response.read()
+        return (codec or utils.get_json_codec()).loads(data)
+    text = yield from response.text(encoding='utf-8')
     return text
 
 class Route:
@@ -87,9 +88,10 @@ class HTTPClient:
     SUCCESS_LOG = '{method} {url} has received {text}'
     REQUEST_LOG = '{method} {url} with {json} has returned {status}'
 
-    def __init__(self, connector=None, *, loop=None):
+    def __init__(self, connector=None, *, loop=None, json_codec=None):
         self.loop = asyncio.get_event_loop() if loop is None else loop
         self.connector = connector
+        self._json = utils.get_json_codec(json_codec)
         self.session = aiohttp.ClientSession(connector=connector, loop=self.loop)
         self._locks = weakref.WeakValueDictionary()
         self._global_over = asyncio.Event(loop=self.loop)
@@ -123,7 +125,7 @@ class HTTPClient:
         # some checking if it's a JSON request
         if 'json' in kwargs:
             headers['Content-Type'] = 'application/json'
-            kwargs['data'] = utils.to_json(kwargs.pop('json'))
+            kwargs['data'] = self._json.dumps(kwargs.pop('json'))
 
         kwargs['headers'] = headers
 
@@ -138,7 +140,7 @@ class HTTPClient:
                 log.debug(self.REQUEST_LOG.format(method=method, url=url, status=r.status, json=kwargs.get('data')))
                 try:
                     # even errors have text involved in them so this is safe to call
-                    data = yield from json_or_text(r)
+                    data = yield from json_or_text(r, self._json)
 
                     # check if we have rate limit header information
                     remaining = r.headers.get('X-Ratelimit-Remaining')
@@ -306,7 +308,7 @@ class HTTPClient:
         if embed:
             payload['embed'] = embed
 
-        form.add_field('payload_json', utils.to_json(payload))
+        form.add_field('payload_json', self._json.dumps(payload))
         form.add_field('file', buffer, filename=filename, content_type='application/octet-stream')
 
         return self.request(r, data=form)
@@ -628,21 +630,30 @@ class HTTPClient:
         return self.request(Route('GET', '/oauth2/applications/@me'))
 
     @asyncio.coroutine
-    def get_gateway(self):
+    def get_gateway(self, *, zlib=False, encoding='json'):
         try:
             data = yield from self.request(Route('GET', '/gateway'))
         except HTTPException as e:
             raise GatewayNotFound() from e
-        return data.get('url') + '?encoding=json&v=6'
+
+        if zlib:
+            value = '{0}?encoding={1}&v=6&compress=zlib-stream'
+        else:
+            value = '{0}?encoding={1}&v=6'
+        return value.format(data['url'], encoding)
 
     @asyncio.coroutine
-    def get_bot_gateway(self):
+    def get_bot_gateway(self, *, zlib=False, encoding='json'):
         try:
             data = yield from self.request(Route('GET', '/gateway/bot'))
         except HTTPException as e:
             raise GatewayNotFound() from e
+
+        if zlib:
+            value = '{0}?encoding={1}&v=6&compress=zlib-stream'
         else:
-            return data['shards'], data['url'] + '?encoding=json&v=6'
+            value = '{0}?encoding={1}&v=6'
+        return data['shards'], value.format(data['url'], encoding)
 
     def get_user_info(self, user_id):
         return self.request(Route('GET', '/users/{user_id}', user_id=user_id))
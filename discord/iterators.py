@@ -32,6 +32,10 @@ from .object import Object
 
 PY35 = sys.version_info >= (3, 5)
 
+def _message_id(message):
+    # the history comes as Message objects from the cache and as dicts otherwise
+    return message.id if isinstance(message, Message) else message['id']
+
 
 class LogsFromIterator:
     """Iterator for recieving logs.
@@ -92,18 +96,18 @@ class LogsFromIterator:
 
             self._retrieve_messages = self._retrieve_messages_around_strategy
             if self.before and self.after:
-                self._filter = lambda m: int(self.after.id) < int(m['id']) < int(self.before.id)
+                self._filter = lambda m: int(self.after.id) < int(_message_id(m)) < int(self.before.id)
             elif self.before:
-                self._filter = lambda m: int(m['id']) < int(self.before.id)
+                self._filter = lambda m: int(_message_id(m)) < int(self.before.id)
             elif self.after:
-                self._filter = lambda m: int(self.after.id) < int(m['id'])
+                self._filter = lambda m: int(self.after.id) < int(_message_id(m))
         elif self.before and self.after:
             if self.reverse:
                 self._retrieve_messages = self._retrieve_messages_after_strategy
-                self._filter = lambda m: int(m['id']) < int(self.before.id)
+                self._filter = lambda m: int(_message_id(m)) < int(self.before.id)
             else:
                 self._retrieve_messages = self._retrieve_messages_before_strategy
-                self._filter = lambda m: int(m['id']) > int(self.after.id)
+                self._filter = lambda m: int(_message_id(m)) > int(self.after.id)
         elif self.after:
             self._retrieve_messages = self._retrieve_messages_after_strategy
         else:
@@ -126,9 +130,17 @@ class LogsFromIterator:
             if self._filter:
                 data = filter(self._filter, data)
             for element in data:
-                yield from self.messages.put(
-                    self.connection._create_message(
-                        channel=self.channel, **element))
+                if not isinstance(element, Message):
+                    element = self.connection._create_message(channel=self.channel, **element)
+                yield from self.messages.put(element)
+
+    @asyncio.coroutine
+    def _logs_from(self, retrieve, **kwargs):
+        """Retrieve messages from the cache if it has them, otherwise from the API."""
+        data = self.connection._cached_logs(self.channel, retrieve, **kwargs)
+        if data is None:
+            data = yield from self.client._logs_from(self.channel, retrieve, **kwargs)
+        return data
 
     @asyncio.coroutine
     def _retrieve_messages(self, retrieve):
@@ -138,26 +150,26 @@ class LogsFromIterator:
     @asyncio.coroutine
     def _retrieve_messages_before_strategy(self, retrieve):
         """Retrieve messages using before parameter."""
-        data = yield from self.client._logs_from(self.channel, retrieve, before=self.before)
+        data = yield from self._logs_from(retrieve, before=self.before)
         if len(data):
             self.limit -= retrieve
-            self.before = Object(id=data[-1]['id'])
+            self.before = Object(id=_message_id(data[-1]))
         return data
 
     @asyncio.coroutine
     def _retrieve_messages_after_strategy(self, retrieve):
         """Retrieve messages using after parameter."""
-        data = yield from self.client._logs_from(self.channel, retrieve, after=self.after)
+        data = yield from self._logs_from(retrieve, after=self.after)
         if len(data):
             self.limit -= retrieve
-            self.after = Object(id=data[0]['id'])
+            self.after = Object(id=_message_id(data[0]))
         return data
 
     @asyncio.coroutine
     def _retrieve_messages_around_strategy(self, retrieve):
         """Retrieve messages using around parameter."""
         if self.around:
-            data = yield from self.client._logs_from(self.channel, retrieve, around=self.around)
+            data = yield from self._logs_from(retrieve, around=self.around)
             self.around = None
             return data
         return []
@@ -24,7 +24,7 @@ FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 DEALINGS IN THE SOFTWARE.
 """
 
-from .user import User
+from .user import BaseUser, User
 from .game import Game
 from .permissions import Permissions
 from . import utils
@@ -74,8 +74,19 @@ def flatten_voice_states(cls):
         setattr(cls, attr, property(getter))
     return cls
 
+def flatten_user(cls):
+    # the user data lives in a User shared by every Member of the same user
+    for attr in ('name', 'id', 'discriminator', 'avatar', 'bot'):
+        def getter(self, x=attr):
+            return getattr(self._user, x)
+        def setter(self, value, x=attr):
+            setattr(self._user, x, value)
+        setattr(cls, attr, property(getter, setter))
+    return cls
+
 @flatten_voice_states
-class Member(User):
+@flatten_user
+class Member(BaseUser):
     """Represents a Discord member to a :class:`Server`.
 
     This is a subclass of :class:`User` that extends more functionality
@@ -103,10 +114,13 @@ class Member(User):
         The server specific nickname of the user.
     """
 
-    __slots__ = [ 'roles', 'joined_at', 'status', 'game', 'server', 'nick', 'voice' ]
+    __slots__ = [ '_user', 'roles', 'joined_at', 'status', 'game', 'server', 'nick', 'voice' ]
 
     def __init__(self, **kwargs):
-        super().__init__(**kwargs.get('user'))
+        # the user can be given as a User so that the members of the
+        # user in every server share it
+        user = kwargs.get('user')
+        self._user = user if isinstance(user, User) else User(**user)
         self.voice = VoiceState(**kwargs)
         self.joined_at = utils.parse_time(kwargs.get('joined_at'))
         self.roles = kwargs.get('roles', [])
@@ -144,6 +158,7 @@ class Member(User):
     def _copy(self):
         ret = copy.copy(self)
         ret.voice = copy.copy(self.voice)
+        ret._user = copy.copy(self._user)
         return ret
 
     @property
@@ -220,3 +235,6 @@ class Member(User):
             return Permissions.all()
 
         return base
+
+# a Member is still a User as far as isinstance and issubclass are concerned
+User.register(Member)
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+"""
+The MIT License (MIT)
+
+Copyright (c) 2015-2016 Rapptz
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+from collections import OrderedDict
+import time
+
+__all__ = [ 'MemberCachePolicy' ]
+
+class MemberCachePolicy:
+    """Decides which members are kept in :attr:`Server.members`.
+
+    Pass one to :class:`Client` through the ``member_cache_policy`` option.
+    The policy is asked about a member every time the member is created or
+    updated by the gateway, and a member it rejects is dropped from the
+    cache. The client's own member is always cached.
+
+    Members that are not cached can still be requested with
+    :meth:`Client.query_members`, and events about them are dispatched
+    with the data Discord sends. :meth:`Server.get_member` returns
+    ``None`` for them.
+
+    The default policy caches every member. Use the class methods to get
+    the built-in policies, and ``|`` and ``&`` to combine policies, e.g.
+    ``MemberCachePolicy.voice() | MemberCachePolicy.recent(ttl=600)``.
+
+    Custom policies can subclass this and override :meth:`cache`, and
+    :meth:`seen` and :meth:`expired` if they track members over time.
+    """
+
+    def cache(self, member):
+        """Returns ``True`` if the member should be cached."""
+        return True
+
+    def seen(self, server, member_id):
+        """Called whenever the member with the ID is active in the server,
+        i.e. it sends a message, starts typing, joins or its presence or
+        voice state changes. If the member is cached, or the event carries
+        its member data, it is checked with :meth:`cache` right after.
+        Members that arrive in bulk, e.g. in GUILD_CREATE or a member
+        chunk, are only checked with :meth:`cache`."""
+        pass
+
+    def expired(self, server):
+        """Returns the IDs of the members of the server that might have to
+        be dropped now. Each of them is checked with :meth:`cache` again.
+        This is called after every :meth:`seen`, so a policy that tracks
+        members can forget the ones that expired here."""
+        return ()
+
+    def __or__(self, other):
+        return _AnyPolicy(self, other)
+
+    def __and__(self, other):
+        return _AllPolicy(self, other)
+
+    @classmethod
+    def all(cls):
+        """A policy that caches every member. This is the default."""
+        return cls()
+
+    @classmethod
+    def none(cls):
+        """A policy that only caches the client's own member."""
+        return cls.from_predicate(lambda member: False)
+
+    @classmethod
+    def online(cls):
+        """A policy that caches members whose status is not offline."""
+        return cls.from_predicate(lambda member: str(member.status) != 'offline')
+
+    @classmethod
+    def voice(cls):
+        """A policy that caches members connected to a voice channel."""
+        return cls.from_predicate(lambda member: member.voice_channel is not None)
+
+    @classmethod
+    def recent(cls, *, max_members=None, ttl=None):
+        """A policy that caches the members that were active recently, see :meth:`seen`.
+
+        Parameters
+        -----------
+        max_members : Optional[int]
+            The number of members cached per server. The least recently
+            seen member is dropped first.
+        ttl : Optional[float]
+            The number of seconds a member stays cached after it was last seen.
+        """
+        return _RecentPolicy(max_members, ttl)
+
+    @classmethod
+    def from_predicate(cls, predicate):
+        """A policy that caches the members for which ``predicate(member)``
+        returns ``True``."""
+        return _PredicatePolicy(predicate)
+
+class _PredicatePolicy(MemberCachePolicy):
+    def __init__(self, predicate):
+        self.predicate = predicate
+
+    def cache(self, member):
+        return self.predicate(member)
+
+class _AnyPolicy(MemberCachePolicy):
+    def __init__(self, *policies):
+        self.policies = policies
+
+    def cache(self, member):
+        return any(policy.cache(member) for policy in self.policies)
+
+    def seen(self, server, member_id):
+        for policy in self.policies:
+            policy.seen(server, member_id)
+
+    def expired(self, server):
+        return [member_id for policy in self.policies for member_id in policy.expired(server)]
+
+class _AllPolicy(_AnyPolicy):
+    def cache(self, member):
+        return all(policy.cache(member) for policy in self.policies)
+
+class _RecentPolicy(MemberCachePolicy):
+    def __init__(self, max_members, ttl):
+        self.max_members = max_members
+        self.ttl = ttl
+        # server ID -> member ID -> when the member was last seen,
+        # least recently seen first.
+        self._seen = {}
+
+    def seen(self, server, member_id):
+        seen = self._seen.setdefault(server.id, OrderedDict())
+        seen.pop(member_id, None)
+        seen[member_id] = time.monotonic()
+
+    def cache(self, member):
+        seen = self._seen.get(member.server.id)
+        return seen is not None and member.id in seen
+
+    def expired(self, server):
+        seen = self._seen.get(server.id)
+        if not seen:
+            return ()
+
+        result = []
+        while self.max_members is not None and len(seen) > self.max_members:
+            result.append(seen.popitem(last=False)[0])
+
+        if self.ttl is not None:
+            deadline = time.monotonic() - self.ttl
+            while seen:
+                member_id, last_seen = next(iter(seen.items()))
+                if last_seen > deadline:
+                    break
+                del seen[member_id]
+                result.append(member_id)
+
+        return result
@@ -169,7 +169,7 @@ class Message:
             self.channel_mentions = utils._unique(it)
 
             for role_id in role_mentions:
-                role = utils.get(self.server.roles, id=role_id)
+                role = self.server.get_role(role_id)
                 if role is not None:
                     self.role_mentions.append(role)
 
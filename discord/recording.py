@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+"""
+The MIT License (MIT)
+
+Copyright (c) 2015-2016 Rapptz
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+from .gateway import DiscordWebSocket, ResumeWebSocket, _get_codec
+
+from collections import namedtuple
+import asyncio
+import logging
+import struct
+import time
+
+log = logging.getLogger(__name__)
+
+__all__ = [ 'GatewayRecorder', 'GatewayReplay', 'ReplayStats', 'read_recording' ]
+
+RECORDING_HEADER = b'DPYREC1\n'
+
+# timestamp, shard ID (-1 if not sharded) and length of the message
+_RECORD = struct.Struct('<dhI')
+
+ReplayStats = namedtuple('ReplayStats', 'frames elapsed')
+
+def read_recording(path):
+    """Iterates over the messages of a recording written by :class:`GatewayRecorder`.
+
+    Yields ``(timestamp, shard_id, data)`` tuples where ``data`` is the
+    message as bytes. A record cut short by a crash ends the iteration.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(RECORDING_HEADER)) != RECORDING_HEADER:
+            raise ValueError('{} is not a gateway recording'.format(path))
+
+        while True:
+            head = f.read(_RECORD.size)
+            if len(head) < _RECORD.size:
+                return
+
+            timestamp, shard_id, size = _RECORD.unpack(head)
+            data = f.read(size)
+            if len(data) < size:
+                return
+
+            yield timestamp, None if shard_id == -1 else shard_id, data
+
+class GatewayRecorder:
+    """Appends every message received by the gateway to a file.
+
+    Messages are recorded after zlib decompression but before any other
+    processing, along with the time they were received and the shard that
+    received them. Pass one to :class:`Client` through the ``recorder``
+    option and feed the file to :class:`GatewayReplay` afterwards.
+
+    Parameters
+    -----------
+    path : str
+        The path of the recording. An existing recording is appended to.
+
+    Attributes
+    -----------
+    frames : int
+        The number of messages recorded by this recorder.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.frames = 0
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(RECORDING_HEADER)
+
+    def record(self, shard_id, data):
+        """Appends a message to the recording."""
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+
+        self._file.write(_RECORD.pack(time.time(), -1 if shard_id is None else shard_id, len(data)))
+        self._file.write(data)
+        self.frames += 1
+
+    def flush(self):
+        """Flushes the buffered messages to the file."""
+        self._file.flush()
+
+    def close(self):
+        """Flushes and closes the recording."""
+        if not self._file.closed:
+            self._file.close()
+
+class _ReplayWebSocket(DiscordWebSocket):
+    # there is no connection so everything that would be sent is dropped
+
+    @asyncio.coroutine
+    def send_as_json(self, data):
+        pass
+
+    @asyncio.coroutine
+    def identify(self):
+        pass
+
+    @asyncio.coroutine
+    def resume(self):
+        pass
+
+    @asyncio.coroutine
+    def close(self, code=1000, reason=''):
+        pass
+
+class GatewayReplay:
+    """Feeds a recording through the :class:`ConnectionState` and the event
+    handlers of a :class:`Client`, without connecting to Discord.
+
+    The messages go through the same code path as the ones received from the
+    gateway, so the client's ``json_codec``, ``ignored_events`` and
+    ``guild_allowlist`` apply. Anything the client would send, e.g. member
+    chunk requests, is dropped. The client does not need to be logged in.
+
+    Parameters
+    -----------
+    path : str
+        The path of a recording written by :class:`GatewayRecorder`.
+    client : :class:`Client`
+        The client to replay the recording into.
+    """
+
+    def __init__(self, path, client):
+        self.path = path
+        self.client = client
+        self._websockets = {}
+
+    def _get_websocket(self, shard_id):
+        ws = self._websockets.get(shard_id)
+        if ws is not None:
+            return ws
+
+        client = self.client
+        ws = _ReplayWebSocket(loop=client.loop)
+        ws._connection = client.connection
+        ws._dispatch = client.dispatch
+        ws.shard_id = shard_id
+        ws.shard_count = client.shard_count
+        ws._encoding = client._encoding
+        ws._codec = _get_codec(client)
+        ws._ignored_events = client._ignored_events
+        ws._guild_allowlist = client._guild_allowlist
+        ws._offload_threshold = client._offload_threshold
+        self._websockets[shard_id] = ws
+
+        shards = getattr(client, 'shards', None)
+        if shards is None:
+            client.ws = ws
+        else:
+            # imported here since it would be a circular import otherwise
+            from .shard import Shard
+            shards[shard_id] = Shard(ws, client)
+            client.connection.shard_ids += (shard_id,)
+            client.connection.shard_count = client.shard_count
+
+        return ws
+
+    @asyncio.coroutine
+    def run(self, *, speed=None):
+        """|coro|
+
+        Replays the recording.
+
+        Parameters
+        -----------
+        speed : Optional[float]
+            How fast to replay the recording compared to the recorded pace,
+            e.g. ``1.0`` for real time or ``10.0`` for ten times faster. If
+            ``None`` the messages are replayed as fast as possible.
+
+        Returns
+        --------
+        :class:`ReplayStats`
+            The number of messages replayed and the seconds it took.
+        """
+        loop = self.client.loop
+        start = loop.time()
+        first = None
+        frames = 0
+
+        for timestamp, shard_id, data in read_recording(self.path):
+            if speed is not None:
+                if first is None:
+                    first = timestamp
+
+                delay = (timestamp - first) / speed - (loop.time() - start)
+                if delay > 0:
+                    yield from asyncio.sleep(delay, loop=loop)
+
+            ws = self._get_websocket(shard_id)
+            if ws._encoding == 'json':
+                # bytes would be taken for a compressed message
+                data = data.decode('utf-8')
+
+            try:
+                yield from ws.received_message(data)
+            except ResumeWebSocket:
+                # a RECONNECT was recorded, the next messages
+                # simply belong to the new connection.
+                pass
+
+            frames += 1
+
+            # let the tasks created by the dispatched events run
+            yield from asyncio.sleep(0, loop=loop)
+
+        for ws in self._websockets.values():
+            # the events held back by the last jobs are part of the replay
+            yield from ws._drain_backlogs()
+            if ws._keep_alive is not None:
+                ws._keep_alive.stop()
+
+        elapsed = loop.time() - start
+        log.info('Replayed {} messages in {:.3f} seconds.'.format(frames, elapsed))
+        return ReplayStats(frames=frames, elapsed=elapsed)
@@ -27,12 +27,35 @@ DEALINGS IN THE SOFTWARE.
 from . import utils
 from .role import Role
 from .member import Member
+from .user import User
 from .emoji import Emoji
 from .game import Game
 from .channel import Channel
 from .enums import ServerRegion, Status, try_enum, VerificationLevel
 from .mixins import Hashable
 
+import asyncio
+
+def _find_member_named(members, name):
+    # the lookup of Server.get_member_named, shared with the
+    # command converters that look up the members of a query.
+    if len(name) > 5 and name[-5] == '#':
+        # The 5 length is checking to see if #0000 is in the string,
+        # as a#0000 has a length of 6, the minimum for a potential
+        # discriminator lookup.
+        potential_discriminator = name[-4:]
+
+        # do the actual lookup and return if found
+        # if it isn't found then we'll do a full name lookup below.
+        result = utils.get(members, name=name[:-5], discriminator=potential_discriminator)
+        if result is not None:
+            return result
+
+    def pred(m):
+        return m.nick == name or m.name == name
+
+    return utils.find(pred, members)
+
 class Server(Hashable):
     """Represents a Discord server.
 
@@ -112,12 +135,16 @@ class Server(Hashable):
                  'name', 'id', 'owner', 'unavailable', 'name', 'region',
                  '_default_role', '_default_channel', 'roles', '_member_count',
                  'large', 'owner_id', 'mfa_level', 'emojis', 'features',
-                 'verification_level', 'splash' ]
+                 'verification_level', 'splash', '_chunked', '_roles_by_id', '_role_hierarchy',
+                 '_state' ]
 
     def __init__(self, **kwargs):
+        # the ConnectionState the server belongs to
+        self._state = kwargs.get('state')
         self._channels = {}
         self.owner = None
         self._members = {}
+        self._chunked = False
         self._from_data(kwargs)
 
     @property
@@ -142,8 +169,41 @@ class Server(Hashable):
         """Returns a :class:`Member` with the given ID. If not found, returns None."""
         return self._members.get(user_id)
 
-    def _add_member(self, member):
-        self._members[member.id] = member
+    @property
+    def me(self):
+        return self.get_member(self._state.user.id)
+
+    @property
+    def voice_client(self):
+        return self._state._get_voice_client(self.id)
+
+    def _cache_member(self, member, seen):
+        # the ConnectionState applies the member cache policy
+        if self._state is None:
+            return True
+        return self._state._cache_member(self, member, seen)
+
+    def _store_user(self, data):
+        # the ConnectionState shares the User between servers
+        if self._state is None:
+            return User(**data)
+        return self._state._store_user(data)
+
+    def get_role(self, role_id):
+        """Returns a :class:`Role` with the given ID. If not found, returns None."""
+        return self._roles_by_id.get(role_id)
+
+    def _add_member(self, member, seen=False):
+        # adds the member, or drops it if the member cache policy rejects it.
+        # seen is True if the member was active rather than part of a bulk payload
+        if self._cache_member(member, seen):
+            self._members[member.id] = member
+        else:
+            self._members.pop(member.id, None)
+
+    def _apply_member_cache_policy(self):
+        for member in list(self._members.values()):
+            self._add_member(member)
 
     def _remove_member(self, member):
         self._members.pop(member.id, None)
@@ -172,10 +232,14 @@ class Server(Hashable):
             r.position += bool(r.position)
 
         self.roles.append(role)
+        self._roles_by_id[role.id] = role
+        self._role_hierarchy = None
 
     def _remove_role(self, role):
         # this raises ValueError if it fails..
         self.roles.remove(role)
+        self._roles_by_id.pop(role.id, None)
+        self._role_hierarchy = None
 
         # since it didn't, we can change the positions now
         # basically the same as above except we only decrement
@@ -198,53 +262,76 @@ class Server(Hashable):
         self.unavailable = guild.get('unavailable', False)
         self.id = guild['id']
         self.roles = [Role(server=self, **r) for r in guild.get('roles', [])]
+        self._roles_by_id = { role.id: role for role in self.roles }
+        self._role_hierarchy = None
         self.mfa_level = guild.get('mfa_level')
         self.emojis = [Emoji(server=self, **r) for r in guild.get('emojis', [])]
         self.features = guild.get('features', [])
         self.splash = guild.get('splash')
 
         for mdata in guild.get('members', []):
-            roles = [self.default_role]
-            for role_id in mdata['roles']:
-                role = utils.find(lambda r: r.id == role_id, self.roles)
-                if role is not None:
-                    roles.append(role)
-
-            mdata['roles'] = sorted(roles)
-            member = Member(**mdata)
-            member.server = self
-            self._add_member(member)
+            self._add_member_from_data(mdata)
 
         self._sync(guild)
         self.large = None if member_count is None else self._member_count >= 250
 
         if 'owner_id' in guild:
             self.owner_id = guild['owner_id']
-            self.owner = self.get_member(self.owner_id)
 
         afk_id = guild.get('afk_channel_id')
         self.afk_channel = self.get_channel(afk_id)
 
-        for obj in guild.get('voice_states', []):
+        self._resolve_members(guild.get('voice_states', []))
+
+        # the policy can only be applied once the members are complete
+        if 'members' in guild:
+            self._apply_member_cache_policy()
+
+    def _resolve_members(self, voice_states):
+        # the parts of the data that refer to members, done after adding them
+        owner_id = getattr(self, 'owner_id', None)
+        if owner_id is not None:
+            self.owner = self.get_member(owner_id)
+
+        for obj in voice_states:
             self._update_voice_state(obj)
 
+    def _add_member_from_data(self, mdata):
+        roles = [self.default_role]
+        for role_id in mdata['roles']:
+            role = self._roles_by_id.get(role_id)
+            if role is not None:
+                roles.append(role)
+
+        mdata['roles'] = sorted(roles)
+        mdata['user'] = self._store_user(mdata['user'])
+        member = Member(**mdata)
+        member.server = self
+        self._members[member.id] = member
+        return member
+
+    def _update_presence(self, presence):
+        user_id = presence['user']['id']
+        member = self.get_member(user_id)
+        if member is not None:
+            member.status = presence['status']
+            try:
+                member.status = Status(member.status)
+            except:
+                pass
+            game = presence.get('game', {})
+            member.game = Game(**game) if game else None
+
     def _sync(self, data):
         if 'large' in data:
             self.large = data['large']
 
         for presence in data.get('presences', []):
-            user_id = presence['user']['id']
-            member = self.get_member(user_id)
-            if member is not None:
-                member.status = presence['status']
-                try:
-                    member.status = Status(member.status)
-                except:
-                    pass
-                game = presence.get('game', {})
-                member.game = Game(**game) if game else None
+            self._update_presence(presence)
 
         if 'channels' in data:
+            # the payload has every channel, the ones missing were deleted
+            self._channels = {}
             channels = data['channels']
             for c in channels:
                 channel = Channel(server=self, **c)
@@ -280,6 +367,35 @@ class Server(Hashable):
         """Returns the true member count regardless of it being loaded fully or not."""
         return self._member_count
 
+    @property
+    def chunked(self):
+        """Returns a boolean indicating if every member of the server is in the cache.
+
+        This is ``False`` for large servers until their members were requested,
+        see :meth:`chunk`. Members dropped by the ``member_cache_policy``
+        of the :class:`Client` don't count as missing.
+        """
+        if getattr(self, '_chunked', False):
+            return True
+        count = getattr(self, '_member_count', None)
+        return count is None or len(self._members) >= count
+
+    @asyncio.coroutine
+    def chunk(self):
+        """|coro|
+
+        Requests every member of the server and waits until they were
+        added to the cache. Does nothing if the server is already
+        :attr:`chunked`.
+
+        Raises
+        -------
+        asyncio.TimeoutError
+            Not every member arrived within 30 seconds per 1000 members.
+        """
+        if not self.chunked:
+            yield from self._state._chunk_server(self)
+
     @property
     def created_at(self):
         """Returns the server's creation time in UTC."""
@@ -292,7 +408,10 @@ class Server(Hashable):
         The first element of this list will be the highest role in the
         hierarchy.
         """
-        return sorted(self.roles, reverse=True)
+        # sorted again only after the roles or their positions changed
+        if self._role_hierarchy is None:
+            self._role_hierarchy = sorted(self.roles, reverse=True)
+        return list(self._role_hierarchy)
 
     def get_member_named(self, name):
         """Returns the first member found that matches the name provided.
@@ -321,21 +440,4 @@ class Server(Hashable):
             then ``None`` is returned.
         """
 
-        result = None
-        members = self.members
-        if len(name) > 5 and name[-5] == '#':
-            # The 5 length is checking to see if #0000 is in the string,
-            # as a#0000 has a length of 6, the minimum for a potential
-            # discriminator lookup.
-            potential_discriminator = name[-4:]
-
-            # do the actual lookup and return if found
-            # if it isn't found then we'll do a full name lookup below.
-            result = utils.get(members, name=name[:-5], discriminator=potential_discriminator)
-            if result is not None:
-                return result
-
-        def pred(m):
-            return m.nick == name or m.name == name
-
-        return utils.find(pred, members)
+        return _find_member_named(self.members, name)
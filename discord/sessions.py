@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+"""
+The MIT License (MIT)
+
+Copyright (c) 2015-2016 Rapptz
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+from .errors import ClientException
+from . import utils
+
+import json
+import logging
+import os
+import time
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+log = logging.getLogger(__name__)
+
+__all__ = [ 'SessionStore', 'FileSessionStore', 'SQLiteSessionStore' ]
+
+class SessionStore:
+    """The interface used to persist gateway sessions across restarts.
+
+    Subclasses must implement :meth:`load`, :meth:`save` and :meth:`delete`.
+    Every method takes the shard ID of the session, which is ``0`` when the
+    client is not sharded.
+
+    Parameters
+    -----------
+    max_age : float
+        The number of seconds a saved session is considered resumable for.
+        Older sessions are ignored by :meth:`get`. Defaults to 5 minutes.
+    """
+
+    def __init__(self, *, max_age=300.0):
+        self.max_age = max_age
+
+    def load(self, shard_id):
+        """Returns a ``(session_id, sequence, saved_at)`` tuple or ``None``."""
+        raise NotImplementedError
+
+    def save(self, shard_id, session_id, sequence):
+        """Saves the session of a shard, replacing the previous one."""
+        raise NotImplementedError
+
+    def delete(self, shard_id):
+        """Forgets the session of a shard."""
+        raise NotImplementedError
+
+    def get(self, shard_id):
+        """Returns the ``(session_id, sequence)`` to RESUME the shard with.
+
+        The session is removed from the store since it can only be resumed
+        once. ``(None, None)`` is returned if there is no usable session.
+        """
+        try:
+            data = self.load(shard_id)
+        except Exception:
+            log.exception('Failed to load the session of shard ID {}'.format(shard_id))
+            return None, None
+
+        if data is None:
+            return None, None
+
+        try:
+            self.delete(shard_id)
+        except Exception:
+            # a session that is still stored is rejected by Discord at
+            # worst, which falls back to IDENTIFY like a missing one.
+            log.exception('Failed to delete the session of shard ID {}'.format(shard_id))
+
+        try:
+            session_id, sequence, saved_at = data
+            expired = saved_at + self.max_age < time.time()
+        except (TypeError, ValueError):
+            log.warning('Ignoring the invalid session of shard ID {}: {!r}'.format(shard_id, data))
+            return None, None
+
+        if expired:
+            log.info('The saved session of shard ID {} is too old to RESUME.'.format(shard_id))
+            return None, None
+        return session_id, sequence
+
+class FileSessionStore(SessionStore):
+    """A :class:`SessionStore` that keeps every session in a single JSON file.
+
+    Parameters
+    -----------
+    path : str
+        The path of the file.
+    """
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+
+    def _read(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _write(self, data):
+        # write to a temporary file first so a crash can't leave half a file behind
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(utils.to_json(data))
+        os.replace(tmp, self.path)
+
+    def load(self, shard_id):
+        entry = self._read().get(str(shard_id))
+        return tuple(entry) if entry else None
+
+    def save(self, shard_id, session_id, sequence):
+        data = self._read()
+        data[str(shard_id)] = [session_id, sequence, time.time()]
+        self._write(data)
+
+    def delete(self, shard_id):
+        data = self._read()
+        if data.pop(str(shard_id), None) is not None:
+            self._write(data)
+
+class SQLiteSessionStore(SessionStore):
+    """A :class:`SessionStore` backed by an SQLite database.
+
+    This is useful when many processes share the same store since SQLite
+    takes care of the locking.
+
+    Parameters
+    -----------
+    path : str
+        The path of the database file.
+    """
+
+    def __init__(self, path, **kwargs):
+        if sqlite3 is None:
+            raise ClientException('sqlite3 is not available in this Python installation.')
+
+        super().__init__(**kwargs)
+        self.path = path
+        self._execute('CREATE TABLE IF NOT EXISTS sessions ('
+                      'shard_id INTEGER PRIMARY KEY, session_id TEXT, '
+                      'sequence INTEGER, saved_at REAL)')
+
+    def _execute(self, query, parameters=()):
+        conn = sqlite3.connect(self.path, timeout=10.0)
+        try:
+            with conn:
+                return conn.execute(query, parameters).fetchone()
+        finally:
+            conn.close()
+
+    def load(self, shard_id):
+        return self._execute('SELECT session_id, sequence, saved_at FROM sessions WHERE shard_id = ?',
+                             (shard_id,))
+
+    def save(self, shard_id, session_id, sequence):
+        self._execute('INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)',
+                      (shard_id, session_id, sequence, time.time()))
+
+    def delete(self, shard_id):
+        self._execute('DELETE FROM sessions WHERE shard_id = ?', (shard_id,))
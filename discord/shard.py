@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+
+"""
+The MIT License (MIT)
+
+Copyright (c) 2015-2016 Rapptz
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+from .state import ConnectionState, ReadyState
+from .client import Client
+from .gateway import DiscordWebSocket, ResumeWebSocket
+from .errors import ClientException, ConnectionClosed
+from .channel import PrivateChannel
+from .enums import Status
+from .user import User
+from . import compat
+
+import asyncio
+import itertools
+import logging
+
+log = logging.getLogger(__name__)
+
+class Shard:
+    """Represents a single gateway connection of an :class:`AutoShardedClient`.
+
+    Attributes
+    -----------
+    ws : :class:`DiscordWebSocket`
+        The websocket the shard is currently connected to.
+    """
+
+    def __init__(self, ws, client):
+        self.ws = ws
+        self._client = client
+
+    @property
+    def id(self):
+        """int: The shard ID of this shard."""
+        return self.ws.shard_id
+
+    @property
+    def latency(self):
+        """float: Measures latency between a HEARTBEAT and a HEARTBEAT_ACK in seconds."""
+        return self.ws.latency
+
+    @property
+    def receive_queue_depth(self):
+        """int: The number of received messages waiting to be processed."""
+        return self.ws.receive_queue_depth
+
+    @property
+    def event_lag(self):
+        """float: The number of seconds the last processed message waited to be processed."""
+        return self.ws.event_lag
+
+    @property
+    def is_closed(self):
+        """bool: Indicates if the shard's websocket connection is closed."""
+        return not self.ws.open
+
+    @asyncio.coroutine
+    def run(self):
+        """Polls the shard's websocket until the client is closed."""
+        while not self._client.is_closed:
+            try:
+                yield from self.ws.poll_event()
+            except ResumeWebSocket:
+                if self._client.is_closed:
+                    break
+
+                log.info('Got a request to RESUME the websocket at Shard ID {}.'.format(self.id))
+                yield from self.ws._drain_backlogs()
+                self.ws = yield from DiscordWebSocket.from_client(self._client, shard_id=self.id,
+                                                                  session=self.ws.session_id,
+                                                                  sequence=self.ws.sequence,
+                                                                  resume=True)
+
+class AutoShardedConnectionState(ConnectionState):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.shard_ids = ()
+        self.shard_count = None
+        self._ready_shards = set()
+        self._shards_ready = asyncio.Event(loop=self.loop)
+
+    @asyncio.coroutine
+    def _delay_ready(self):
+        # every shard has to send READY before we know every
+        # server the base class has to wait for.
+        yield from self._shards_ready.wait()
+
+        self._ready_task = None
+        self._warm = False
+        yield from super()._delay_ready()
+
+    def _ensure_ready_state(self):
+        if not hasattr(self, '_ready_state'):
+            self._ready_state = ReadyState(loop=self.loop)
+
+    def _mark_shard_ready(self, shard_id):
+        self._ready_shards.add(shard_id)
+        self.dispatch('shard_ready', shard_id)
+
+        if self._ready_shards.issuperset(self.shard_ids):
+            self._shards_ready.set()
+
+        if self._ready_task is None:
+            self._ready_task = compat.create_task(self._delay_ready(), loop=self.loop)
+
+    def parse_ready(self, data):
+        shard_id = data.get('__shard_id__')
+        if shard_id in self._ready_shards or self._warm:
+            # the shard re-identified (or could not resume the session of a
+            # snapshot) so the servers it owns were invalidated. The other
+            # shards are not affected.
+            for server in list(self.servers):
+                if (int(server.id) >> 22) % self.shard_count == shard_id:
+                    self._remove_server(server)
+
+            # messages were missed while the shard was disconnected
+            self.messages.reset_coverage()
+
+        self._ensure_ready_state()
+        self.user = User(**data['user'])
+
+        for guild in data.get('guilds'):
+            self._add_ready_server(guild)
+
+        for pm in data.get('private_channels'):
+            self._add_private_channel(PrivateChannel(self.user, **pm))
+
+        self._mark_shard_ready(shard_id)
+
+    def parse_resumed(self, data):
+        self.dispatch('resumed')
+        shard_id = data.get('__shard_id__')
+        if self._warm and shard_id not in self._ready_shards:
+            # a shard resumed the session of a snapshot, it counts as ready
+            # since its servers are already in the cache.
+            self._ensure_ready_state()
+            self._mark_shard_ready(shard_id)
+
+class AutoShardedClient(Client):
+    """A client similar to :class:`Client` except it handles the complications
+    of sharding for the user into a more manageable and transparent single
+    process bot.
+
+    When using this client, you will be able to use it as-if it was a regular
+    :class:`Client` with a single shard when implementation wise internally it
+    is split up into multiple shards. Every shard shares the same
+    :class:`ConnectionState` cache and the same HTTP client and therefore the
+    same view of the rate limits.
+
+    If no :attr:`shard_count` is provided, then the library will use the
+    Bot Gateway endpoint call to figure out how many shards to use.
+
+    Parameters
+    -----------
+    shard_ids : Optional[list of int]
+        An optional list of shard IDs to launch the shards with. If given
+        then :attr:`shard_count` must also be given. Defaults to launching
+        every shard from 0 to ``shard_count - 1``.
+
+    Attributes
+    ------------
+    shards : dict
+        A mapping of shard ID to :class:`Shard`.
+    """
+
+    _state_class = AutoShardedConnectionState
+
+    def __init__(self, *args, loop=None, **kwargs):
+        kwargs.pop('shard_id', None)
+        self.shard_ids = kwargs.pop('shard_ids', None)
+        super().__init__(*args, loop=loop, **kwargs)
+
+        if self.shard_ids is not None:
+            if self.shard_count is None:
+                raise ClientException('When passing manual shard_ids, you must provide a shard_count.')
+            elif not isinstance(self.shard_ids, (list, tuple)):
+                raise ClientException('shard_ids parameter must be a list or a tuple.')
+
+        self.shards = {}
+
+    def _get_websocket(self, guild_id):
+        shard_id = (int(guild_id) >> 22) % self.shard_count
+        return self.shards[shard_id].ws
+
+    def _get_websockets(self):
+        return [shard.ws for shard in self.shards.values()]
+
+    @property
+    def latency(self):
+        """float: Measures latency between a HEARTBEAT and a HEARTBEAT_ACK in seconds.
+
+        This operates similarly to :meth:`Client.latency` except it uses the average
+        latency of every shard's latency. To get a list of shard latency, check the
+        :attr:`latencies` property. Returns ``nan`` if there are no shards ready.
+        """
+        if not self.shards:
+            return float('nan')
+        return sum(shard.latency for shard in self.shards.values()) / len(self.shards)
+
+    @property
+    def latencies(self):
+        """List[Tuple[int, float]]: A list of latencies between a HEARTBEAT and a HEARTBEAT_ACK in seconds.
+
+        This returns a list of tuples with elements ``(shard_id, latency)``.
+        """
+        return [(shard_id, shard.latency) for shard_id, shard in self.shards.items()]
+
+    @asyncio.coroutine
+    def request_offline_members(self, server):
+        """|coro|
+
+        Requests previously offline members from the server to be filled up
+        into the :attr:`Server.members` cache. This function is usually not
+        called.
+
+        This operates similarly to :meth:`Client.request_offline_members`
+        except the requests are split up by the shard that owns each server.
+
+        Parameters
+        -----------
+        server : :class:`Server` or iterable
+            The server to request offline members for. If this parameter is a
+            iterable then it is interpreted as an iterator of servers to
+            request offline members for.
+        """
+
+        servers = [server] if hasattr(server, 'id') else list(server)
+
+        def key(s):
+            return (int(s.id) >> 22) % self.shard_count
+
+        for shard_id, sub_servers in itertools.groupby(sorted(servers, key=key), key=key):
+            payload = {
+                'op': 8,
+                'd': {
+                    'guild_id': [s.id for s in sub_servers],
+                    'query': '',
+                    'limit': 0
+                }
+            }
+
+            yield from self.shards[shard_id].ws.send_as_json(payload)
+
+    @asyncio.coroutine
+    def launch_shard(self, shard_id):
+        session, sequence = self._load_session(shard_id)
+        try:
+            ws = yield from DiscordWebSocket.from_client(self, shard_id=shard_id, session=session,
+                                                         sequence=sequence, resume=session is not None)
+        except Exception:
+            log.info('Failed to connect for shard_id: {}. Retrying...'.format(shard_id))
+            yield from asyncio.sleep(5.0, loop=self.loop)
+            return (yield from self.launch_shard(shard_id))
+
+        shard = Shard(ws, self)
+        self.shards[shard_id] = shard
+        return compat.create_task(shard.run(), loop=self.loop)
+
+    @asyncio.coroutine
+    def launch_shards(self):
+        if self.shard_count is None:
+            self.shard_count, gateway = yield from self.http.get_bot_gateway()
+            log.info('Automatically sharding with {} shards.'.format(self.shard_count))
+
+        shard_ids = self.shard_ids if self.shard_ids else range(self.shard_count)
+        self.connection.shard_ids = tuple(shard_ids)
+        self.connection.shard_count = self.shard_count
+
+        # shards of the same group are in different identify buckets so they
+        # can be launched together. The IdentifyScheduler spaces out the rest.
+        concurrency = self._identify_scheduler.max_concurrency
+        groups = [shard_ids[i:i + concurrency] for i in range(0, len(shard_ids), concurrency)]
+
+        tasks = []
+        for group in groups:
+            launched = yield from asyncio.gather(*[self.launch_shard(i) for i in group], loop=self.loop)
+            tasks.extend(launched)
+
+        return tasks
+
+    @asyncio.coroutine
+    def connect(self):
+        """|coro|
+
+        Creates a websocket connection for every shard and lets the
+        websockets listen to messages from discord.
+
+        Raises
+        -------
+        GatewayNotFound
+            If the gateway to connect to discord is not found. Usually if this
+            is thrown then there is a discord API outage.
+        ConnectionClosed
+            The websocket connection has been terminated.
+        """
+        yield from self._load_warm_cache()
+        tasks = yield from self.launch_shards()
+        yield from self._poll_shards(tasks)
+
+    @asyncio.coroutine
+    def _poll_shards(self, tasks):
+        try:
+            done, pending = yield from asyncio.wait(tasks, loop=self.loop,
+                                                    return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+        except ConnectionClosed as e:
+            yield from self.close()
+            if e.code != 1000:
+                raise
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @asyncio.coroutine
+    def change_presence(self, *, game=None, status=None, afk=False, shard_id=None):
+        """|coro|
+
+        Changes the client's presence.
+
+        The game parameter is a Game object (not a string) that represents
+        a game being played currently.
+
+        Parameters
+        ----------
+        game: Optional[:class:`Game`]
+            The game being played. None if no game is being played.
+        status: Optional[:class:`Status`]
+            Indicates what status to change to. If None, then
+            :attr:`Status.online` is used.
+        afk: bool
+            Indicates if you are going AFK. This allows the discord
+            client to know how to handle push notifications better
+            for you in case you are actually idle and not lying.
+        shard_id: Optional[int]
+            The shard ID to change the presence to. If not specified
+            or ``None``, then it will change the presence of every
+            shard the bot can see.
+
+        Raises
+        ------
+        InvalidArgument
+            If the ``game`` parameter is not :class:`Game` or None.
+        """
+
+        if status is None:
+            status = 'online'
+        elif status is Status.offline:
+            status = 'invisible'
+        else:
+            status = str(status)
+
+        if shard_id is None:
+            shards = self.shards.values()
+        else:
+            shards = [self.shards[shard_id]]
+
+        for shard in shards:
+            yield from shard.ws.change_presence(game=game, status=status, afk=afk)
+
+    @asyncio.coroutine
+    def change_status(self, game=None, idle=False):
+        """|coro|
+
+        Changes the client's status on every shard.
+
+        .. deprecated:: v0.13.0
+            Use :meth:`change_presence` instead.
+        """
+        yield from self.change_presence(game=game, status=Status.idle if idle else None)
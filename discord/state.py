@@ -37,67 +37,414 @@ from . import utils, compat
 from .enums import Status, ChannelType, try_enum
 from .calls import GroupCall
 
-from collections import deque, namedtuple
-import copy, enum, math
+from collections import OrderedDict
+import copy, math
 import datetime
+import itertools
 import asyncio
+import bisect
 import logging
+import os
+import pickle
+import weakref
 
-class ListenerType(enum.Enum):
-    chunk = 0
-
-Listener = namedtuple('Listener', ('type', 'future', 'predicate'))
 log = logging.getLogger(__name__)
-ReadyState = namedtuple('ReadyState', ('launch', 'servers'))
+
+# payloads with at least this many members and presences are processed in
+# time slices, see ConnectionState._sliced
+SLICE_THRESHOLD = 500
+
+# the events that keep the cached messages up to date. If any of them is
+# ignored the cache can't answer message history requests.
+HISTORY_EVENTS = frozenset(('MESSAGE_CREATE', 'MESSAGE_UPDATE', 'MESSAGE_DELETE', 'MESSAGE_DELETE_BULK',
+                            'MESSAGE_REACTION_ADD', 'MESSAGE_REACTION_REMOVE', 'MESSAGE_REACTION_REMOVE_ALL'))
+
+def _expected_chunks(server):
+    # Discord sends at most 1000 members per GUILD_MEMBERS_CHUNK
+    return max(1, math.ceil(getattr(server, '_member_count', 0) / 1000))
+
+class ReadyState:
+    """Tracks what is left to receive before READY is complete."""
+
+    def __init__(self, *, loop):
+        # IDs of the servers that were unavailable in READY and did not arrive yet
+        self.pending = set()
+        # set every time one of the pending servers arrives
+        self.progress = asyncio.Event(loop=loop)
+        # the futures of the member requests sent during READY
+        self.chunks = []
+
+    def received(self, server_id):
+        self.pending.discard(server_id)
+        self.progress.set()
+
+class MemberQuery:
+    """Collects the members answering a REQUEST_MEMBERS with a query."""
+
+    __slots__ = ('server', 'members', 'future')
+
+    def __init__(self, server, *, loop):
+        self.server = server
+        self.members = []
+        self.future = asyncio.Future(loop=loop)
+
+    def receive(self, data, members):
+        self.members.extend(members)
+        if data.get('chunk_index', 0) + 1 >= data.get('chunk_count', 1) and not self.future.done():
+            self.future.set_result(self.members)
+
+class ChunkRequest:
+    """Tracks the GUILD_MEMBERS_CHUNK events answering a member request."""
+
+    __slots__ = ('server', 'remaining', 'future')
+
+    def __init__(self, server, *, loop):
+        self.server = server
+        self.remaining = _expected_chunks(server)
+        self.future = asyncio.Future(loop=loop)
+
+    def receive(self, data):
+        """Returns ``True`` once the last chunk was received."""
+        if 'chunk_count' in data:
+            done = data.get('chunk_index', 0) + 1 >= data['chunk_count']
+        else:
+            self.remaining -= 1
+            done = self.remaining <= 0
+
+        if done and not self.future.done():
+            self.future.set_result(self.server)
+        return done
+
+def _channel_id(message):
+    return getattr(message.channel, 'id', None)
+
+class ChannelMessages:
+    """The IDs of the cached messages of a channel, sorted by snowflake."""
+
+    __slots__ = ('ids', 'start')
+
+    def __init__(self):
+        self.ids = []
+        # every message of the channel with an ID of at least start that
+        # was not deleted is cached, None if that is not known for any.
+        self.start = None
+
+    def add(self, message_id):
+        ids = self.ids
+        if not ids or ids[-1] < message_id:
+            ids.append(message_id)
+        else:
+            bisect.insort(ids, message_id)
+
+        if self.start is None:
+            self.start = message_id
+
+    def discard(self, message_id):
+        ids = self.ids
+        index = bisect.bisect_left(ids, message_id)
+        if index < len(ids) and ids[index] == message_id:
+            del ids[index]
+
+    def window(self, limit, before=None, after=None, around=None):
+        # returns the IDs the messages endpoint would return, oldest first,
+        # or None if they are not all known to be cached.
+        if self.start is None:
+            return None
+
+        ids = self.ids
+        lowest = bisect.bisect_left(ids, self.start)
+        if around is not None:
+            if around < self.start:
+                return None
+            index = bisect.bisect_left(ids, around)
+            half = limit // 2
+            if index - lowest < half:
+                return None
+            return ids[index - half:index - half + limit]
+
+        if after is not None:
+            if after + 1 < self.start:
+                return None
+            index = bisect.bisect_right(ids, after)
+            return ids[index:index + limit]
+
+        index = len(ids) if before is None else bisect.bisect_left(ids, before)
+        if index - lowest < limit:
+            return None
+        return ids[index - limit:index]
+
+class MessageCache:
+    """The messages the client received, oldest first, indexed by ID.
+
+    Behaves like a bounded deque: appending to a full cache evicts the
+    oldest message. Looking up, removing and replacing a message by ID does
+    not scan the cache.
+
+    If ``channel_maxlen`` is not ``None`` the messages are also indexed per
+    channel, sorted by snowflake. A channel then holds at most
+    ``channel_maxlen`` messages, its oldest message being evicted first,
+    and :meth:`history` can answer message history requests.
+    """
+
+    def __init__(self, maxlen=None, channel_maxlen=None):
+        self.maxlen = maxlen
+        self.channel_maxlen = channel_maxlen
+        self._messages = OrderedDict()
+        self._channels = {} if channel_maxlen is not None else None
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __iter__(self):
+        return iter(self._messages.values())
+
+    def __reversed__(self):
+        return reversed(self._messages.values())
+
+    def __contains__(self, message):
+        return self._messages.get(getattr(message, 'id', None)) is message
+
+    def __getitem__(self, index):
+        # like a deque, indexing walks from the closest end
+        size = len(self._messages)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError('message cache index out of range')
+
+        if index < size // 2:
+            return next(itertools.islice(iter(self), index, None))
+        return next(itertools.islice(reversed(self), size - index - 1, None))
+
+    def __repr__(self):
+        return '<MessageCache len={} maxlen={}>'.format(len(self), self.maxlen)
+
+    def _forget(self, message, evicted):
+        channel = self._channels.get(_channel_id(message))
+        if channel is None:
+            return
+
+        message_id = int(message.id)
+        channel.discard(message_id)
+        if evicted:
+            if not channel.ids:
+                del self._channels[_channel_id(message)]
+            elif channel.start is not None:
+                # older messages are not cached anymore
+                channel.start = max(channel.start, message_id + 1)
+
+    def append(self, message):
+        messages = self._messages
+        old = messages.pop(message.id, None)
+        messages[message.id] = message
+
+        channels = self._channels
+        if channels is not None:
+            if old is not None:
+                self._forget(old, False)
+
+            channel_id = _channel_id(message)
+            if channel_id is not None:
+                channel = channels.get(channel_id)
+                if channel is None:
+                    channel = channels[channel_id] = ChannelMessages()
+                channel.add(int(message.id))
+
+                if len(channel.ids) > self.channel_maxlen:
+                    self._forget(messages.pop(str(channel.ids[0])), True)
+
+        if self.maxlen is not None and len(messages) > self.maxlen:
+            message_id, evicted = messages.popitem(last=False)
+            if channels is not None:
+                self._forget(evicted, True)
+
+    def get(self, message_id):
+        return self._messages.get(message_id)
+
+    def pop(self, message_id):
+        """Removes and returns the message with the ID, or ``None``."""
+        message = self._messages.pop(message_id, None)
+        if message is not None and self._channels is not None:
+            self._forget(message, False)
+        return message
+
+    def remove(self, message):
+        if self._messages.get(message.id) is not message:
+            raise ValueError('message is not in the cache')
+        self.pop(message.id)
+
+    def clear(self):
+        self._messages.clear()
+        if self._channels is not None:
+            self._channels.clear()
+
+    def reset_coverage(self, channel_ids=None):
+        """Forgets which ranges of history are complete, e.g. after events
+        might have been missed. Only the channels with the IDs given are
+        reset unless ``channel_ids`` is ``None``. The messages stay cached."""
+        if self._channels is None:
+            return
+
+        if channel_ids is None:
+            channel_ids = list(self._channels)
+
+        for channel_id in channel_ids:
+            channel = self._channels.get(channel_id)
+            if channel is not None:
+                channel.start = None
+
+    def history(self, channel_id, limit, *, before=None, after=None, around=None):
+        """Returns the messages of a channel the messages endpoint would
+        return for the snowflakes given, newest first.
+
+        ``None`` is returned if the cache can't tell that it holds every one
+        of them, e.g. because they were sent before the client connected.
+        """
+        if self._channels is None:
+            return None
+
+        channel = self._channels.get(channel_id)
+        if channel is None:
+            return None
+
+        window = channel.window(limit, before=before, after=after, around=around)
+        if window is None:
+            return None
+
+        messages = self._messages
+        return [messages[str(message_id)] for message_id in reversed(window)]
+
+# bumped whenever the pickled models change in an incompatible way
+SNAPSHOT_HEADER = b'DPYSNAP3'
+
+# the servers refer to their ConnectionState, which is not part of a
+# snapshot. The state loading the snapshot takes its place.
+_STATE_ID = 'state'
+
+class _SnapshotPickler(pickle.Pickler):
+    def __init__(self, file, state):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.state = state
+
+    def persistent_id(self, obj):
+        return _STATE_ID if obj is self.state else None
+
+class _SnapshotUnpickler(pickle.Unpickler):
+    def __init__(self, file, state):
+        super().__init__(file)
+        self.state = state
+
+    def persistent_load(self, pid):
+        if pid != _STATE_ID:
+            raise pickle.UnpicklingError('unknown persistent ID {!r}'.format(pid))
+        return self.state
+
+def _read_snapshot(path, state):
+    with open(path, 'rb') as f:
+        if f.read(len(SNAPSHOT_HEADER)) != SNAPSHOT_HEADER:
+            raise ValueError('{} is not a snapshot of this version of the library'.format(path))
+        return _SnapshotUnpickler(f, state).load()
 
 class ConnectionState:
-    def __init__(self, dispatch, chunker, syncer, max_messages, *, loop):
+    def __init__(self, dispatch, chunker, syncer, max_messages, *, loop, guild_ready_timeout=2.0,
+                 chunk_guilds_at_startup=True, background_chunk_interval=None, max_messages_per_channel=None,
+                 member_cache_policy=None):
         self.loop = loop
         self.max_messages = max_messages
+        self.max_messages_per_channel = max_messages_per_channel
+        self.member_cache_policy = member_cache_policy
         self.dispatch = dispatch
         self.chunker = chunker
         self.syncer = syncer
         self.is_bot = None
-        self._listeners = []
+        self.guild_ready_timeout = guild_ready_timeout
+        # the seconds a bulky payload is processed for before yielding
+        self.slice_budget = 0.005
+        self.chunk_guilds_at_startup = chunk_guilds_at_startup
+        self.background_chunk_interval = background_chunk_interval
+        self._background_chunker = None
+        # the pending member requests keyed by server ID and the
+        # servers waiting for their request to be sent.
+        self._chunk_requests = {}
+        self._chunk_queue = []
+        self._chunk_sender = None
+        # the pending member queries keyed by their nonce
+        self._member_queries = {}
+        self._query_nonces = itertools.count()
+        # True while the cache comes from a snapshot and no READY was received yet
+        self._warm = False
+        # the task waiting to dispatch on_ready
+        self._ready_task = None
+        # False if the cached messages might miss events, see HISTORY_EVENTS
+        self.cached_history = True
         self.clear()
 
     def clear(self):
         self.user = None
-        self.sequence = None
-        self.session_id = None
         self._calls = {}
         self._servers = {}
+        # every server channel by ID, so get_channel doesn't scan every server
+        self._channels = {}
+        # the User shared by the members of a user in every server
+        self._users = weakref.WeakValueDictionary()
         self._voice_clients = {}
         self._private_channels = {}
         # extra dict to look up private channels by user id
         self._private_channels_by_user = {}
-        self.messages = deque(maxlen=self.max_messages)
+        self.messages = MessageCache(self.max_messages, self.max_messages_per_channel)
+
+    def dump(self, path):
+        """Writes a snapshot of the servers, private channels and user
+        of the cache to ``path``, to be reloaded with :meth:`load`.
+
+        Messages and voice clients are not part of the snapshot. The
+        models are pickled, see :meth:`load` for what that means.
+        """
+        data = {
+            'user': self.user,
+            'servers': list(self._servers.values()),
+            'private_channels': list(self._private_channels.values())
+        }
+
+        # write to a temporary file first so a crash can't leave half a file behind
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(SNAPSHOT_HEADER)
+            _SnapshotPickler(f, self).dump(data)
+        os.replace(tmp, path)
 
-    def process_listeners(self, listener_type, argument, result):
-        removed = []
-        for i, listener in enumerate(self._listeners):
-            if listener.type != listener_type:
-                continue
+    @asyncio.coroutine
+    def load(self, path):
+        """|coro|
 
-            future = listener.future
-            if future.cancelled():
-                removed.append(i)
-                continue
+        Replaces the cache with a snapshot written by :meth:`dump`. The file
+        is read in an executor so the event loop keeps running.
 
-            try:
-                passed = listener.predicate(argument)
-            except Exception as e:
-                future.set_exception(e)
-                removed.append(i)
-            else:
-                if passed:
-                    future.set_result(result)
-                    removed.append(i)
-                    if listener.type == ListenerType.chunk:
-                        break
+        The snapshot is unpickled, which can run arbitrary code if someone
+        tampered with the file. Only load snapshots from a trusted path.
 
-        for index in reversed(removed):
-            del self._listeners[index]
+        Returns ``True`` if the snapshot was loaded.
+        """
+        try:
+            data = yield from self.loop.run_in_executor(None, _read_snapshot, path, self)
+        except FileNotFoundError:
+            return False
+        except Exception:
+            log.exception('Ignoring the unreadable snapshot at {}'.format(path))
+            return False
+
+        self.clear()
+        self.user = data['user']
+        for server in data['servers']:
+            self._add_server(server)
+            for member in server.members:
+                self._users.setdefault(member.id, member._user)
+        for channel in data['private_channels']:
+            self._add_private_channel(channel)
+
+        self._warm = True
+        log.info('Loaded {} servers from the snapshot at {}'.format(len(self._servers), path))
+        return True
 
     @property
     def voice_clients(self):
@@ -114,7 +461,8 @@ class ConnectionState:
 
     def _update_references(self, ws):
         for vc in self.voice_clients:
-            vc.main_ws = ws
+            if ws.shard_count is None or (int(vc.guild_id) >> 22) % ws.shard_count == ws.shard_id:
+                vc.main_ws = ws
 
     @property
     def servers(self):
@@ -125,9 +473,28 @@ class ConnectionState:
 
     def _add_server(self, server):
         self._servers[server.id] = server
+        for channel in server.channels:
+            self._channels[channel.id] = channel
+
+    def _forget_channels(self, channels):
+        # drops the index entries of channels a payload replaced, the new
+        # ones are indexed by _add_server.
+        for channel in channels:
+            if self._channels.get(channel.id) is channel:
+                del self._channels[channel.id]
 
     def _remove_server(self, server):
         self._servers.pop(server.id, None)
+        for channel in server.channels:
+            self._channels.pop(channel.id, None)
+
+    def _add_channel(self, server, channel):
+        server._add_channel(channel)
+        self._channels[channel.id] = channel
+
+    def _remove_channel(self, server, channel):
+        server._remove_channel(channel)
+        self._channels.pop(channel.id, None)
 
     @property
     def private_channels(self):
@@ -150,46 +517,185 @@ class ConnectionState:
             self._private_channels_by_user.pop(channel.user.id, None)
 
     def _get_message(self, msg_id):
-        return utils.find(lambda m: m.id == msg_id, self.messages)
+        return self.messages.get(msg_id)
+
+    def _cached_logs(self, channel, limit, before=None, after=None, around=None):
+        # the message history from the cache, newest first, or None if
+        # it has to be requested. The arguments are like HTTPClient.logs_from
+        if not self.cached_history:
+            return None
+
+        def snowflake(obj):
+            return None if obj is None else int(obj.id)
+
+        return self.messages.history(channel.id, limit, before=snowflake(before),
+                                     after=snowflake(after), around=snowflake(around))
+
+    def _reset_history(self, server, channel=None):
+        # the permissions of the client might have changed, if it could not
+        # read a channel for a while its messages were missed.
+        channels = server.channels if channel is None else (channel,)
+        self.messages.reset_coverage([c.id for c in channels])
+
+    def _store_user(self, data):
+        user = self._users.get(data['id'])
+        if user is None:
+            user = User(**data)
+            self._users[user.id] = user
+        elif 'username' in data:
+            user.name = data['username']
+            user.discriminator = data.get('discriminator', user.discriminator)
+            user.avatar = data.get('avatar', user.avatar)
+        return user
+
+    def _is_me(self, member):
+        return self.user is not None and member.id == self.user.id
+
+    def _cache_member(self, server, member, seen=False):
+        policy = self.member_cache_policy
+        if policy is None or self._is_me(member):
+            return True
+
+        if seen:
+            policy.seen(server, member.id)
+        keep = policy.cache(member)
+        self._expire_members(server, policy, member)
+        return keep
+
+    def _expire_members(self, server, policy, member=None):
+        # drops the members the policy no longer wants, except for the
+        # member that is being added as the caller decides about it.
+        members = server._members
+        for member_id in policy.expired(server):
+            other = members.get(member_id)
+            if other is not None and other is not member and not self._is_me(other) and not policy.cache(other):
+                del members[member_id]
+
+    def _member_seen(self, server, user_id, member, data):
+        # lets the member cache policy know the member appeared in an event.
+        # A member that isn't cached is made from the member data of the
+        # event, if any, so the policy gets the chance to admit it.
+        policy = self.member_cache_policy
+        if policy is None:
+            return member
+
+        if member is None:
+            if not data or 'user' not in data:
+                # a member made up without its roles and join date would be
+                # wrong, so only the activity is recorded.
+                policy.seen(server, user_id)
+                self._expire_members(server, policy)
+                return None
+            member = self._make_member(server, dict(data))
+
+        server._add_member(member, seen=True)
+        return member
 
     def _add_server_from_data(self, guild):
-        server = Server(**guild)
-        Server.me = property(lambda s: s.get_member(self.user.id))
-        Server.voice_client = property(lambda s: self._get_voice_client(s.id))
+        server = Server(state=self, **guild)
         self._add_server(server)
         return server
 
-    def chunks_needed(self, server):
-        for chunk in range(math.ceil(server._member_count / 1000)):
-            yield self.receive_chunk(server.id)
+    @asyncio.coroutine
+    def _sliced(self, items, func):
+        # calls func with every item, yielding to the event loop every time
+        # a slice used up its budget so that heartbeats and the other tasks
+        # keep running. The gateway runs the job as a task and holds back
+        # the events of the server until it is done.
+        loop = self.loop
+        deadline = loop.time() + self.slice_budget
+        for item in items:
+            func(item)
+            if loop.time() >= deadline:
+                yield from asyncio.sleep(0, loop=loop)
+                deadline = loop.time() + self.slice_budget
+
+    def request_chunks(self, server):
+        """Queues a request for the members of a server.
+
+        Returns a future that is done once every chunk of the
+        answer was received.
+        """
+        request = self._chunk_requests.get(server.id)
+        if request is not None and not request.future.done():
+            return request.future
+
+        request = ChunkRequest(server, loop=self.loop)
+        self._chunk_requests[server.id] = request
+        self._chunk_queue.append(server)
+        if self._chunk_sender is None:
+            self._chunk_sender = compat.create_task(self._send_chunk_requests(), loop=self.loop)
+        return request.future
+
+    @asyncio.coroutine
+    def _chunk_server(self, server):
+        # waits for the members like the other callers of request_chunks do,
+        # the request is shielded since others might be waiting for it too.
+        future = self.request_chunks(server)
+        yield from asyncio.wait_for(asyncio.shield(future),
+                                    timeout=_expected_chunks(server) * 30.0, loop=self.loop)
+
+    def _add_member_query(self, server):
+        nonce = str(next(self._query_nonces))
+        query = MemberQuery(server, loop=self.loop)
+        self._member_queries[nonce] = query
+        return nonce, query.future
+
+    def _get_member_query(self, data):
+        query = self._member_queries.get(data.get('nonce'))
+        if query is None and 'nonce' not in data:
+            # the nonce is not echoed back by every gateway version so
+            # fall back to the oldest query of the server, unless every
+            # member of the server was requested.
+            guild_id = data.get('guild_id')
+            if guild_id not in self._chunk_requests:
+                query = utils.find(lambda q: q.server.id == guild_id, self._member_queries.values())
+        return query
+
+    @asyncio.coroutine
+    def _send_chunk_requests(self):
+        # the servers queued while a request waits for the gateway rate
+        # limit are sent together, up to 75 servers per request.
+        servers = []
+        try:
+            while self._chunk_queue:
+                servers = self._chunk_queue[:75]
+                del self._chunk_queue[:75]
+                yield from self.chunker(servers)
+        except Exception as e:
+            failed = servers + self._chunk_queue
+            log.exception('Failed to request the members of {} servers'.format(len(failed)))
+            del self._chunk_queue[:]
+
+            # forget the requests so the servers can be requested again
+            for server in failed:
+                request = self._chunk_requests.pop(server.id, None)
+                if request is not None and not request.future.done():
+                    request.future.set_exception(e)
+        finally:
+            self._chunk_sender = None
 
     @asyncio.coroutine
     def _delay_ready(self):
-        launch = self._ready_state.launch
-        while not launch.is_set():
-            # this snippet of code is basically waiting 2 seconds
-            # until the last GUILD_CREATE was sent
-            launch.set()
-            yield from asyncio.sleep(2, loop=self.loop)
-
-        servers = self._ready_state.servers
-
-        # get all the chunks
-        chunks = []
-        for server in servers:
-            chunks.extend(self.chunks_needed(server))
-
-        # we only want to request ~75 guilds per chunk request.
-        splits = [servers[i:i + 75] for i in range(0, len(servers), 75)]
-        for split in splits:
-            yield from self.chunker(split)
-
-        # wait for the chunks
-        if chunks:
+        state = self._ready_state
+
+        # wait for the servers that were unavailable in READY, giving up
+        # if none of them arrived for guild_ready_timeout seconds.
+        while state.pending:
             try:
-                yield from asyncio.wait(chunks, timeout=len(chunks) * 30.0, loop=self.loop)
+                yield from asyncio.wait_for(state.progress.wait(), timeout=self.guild_ready_timeout,
+                                            loop=self.loop)
             except asyncio.TimeoutError:
-                log.info('Somehow timed out waiting for chunks.')
+                log.info('Gave up waiting for {} unavailable servers.'.format(len(state.pending)))
+                break
+            state.progress.clear()
+
+        # the member requests were sent as the servers arrived
+        if state.chunks:
+            done, pending = yield from asyncio.wait(state.chunks, timeout=len(state.chunks) * 30.0,
+                                                    loop=self.loop)
+            if pending:
+                log.info('Timed out waiting for the members of {} servers.'.format(len(pending)))
 
         # remove the state
         try:
@@ -205,44 +711,84 @@ class ConnectionState:
         # dispatch the event
         self.dispatch('ready')
 
+        if not self.chunk_guilds_at_startup and self.background_chunk_interval is not None:
+            if self._background_chunker is None or self._background_chunker.done():
+                self._background_chunker = compat.create_task(self._chunk_in_background(), loop=self.loop)
+
+    @asyncio.coroutine
+    def _chunk_in_background(self):
+        # one server at a time so the member requests never compete with
+        # the rest of the gateway traffic for the rate limit.
+        for server in list(self.servers):
+            if server.chunked or self._get_server(server.id) is not server:
+                continue
+
+            future = self.request_chunks(server)
+            done, pending = yield from asyncio.wait([future], timeout=_expected_chunks(server) * 30.0,
+                                                    loop=self.loop)
+            if pending:
+                log.info('Timed out waiting for the members of server ID {}.'.format(server.id))
+
+            yield from asyncio.sleep(self.background_chunk_interval, loop=self.loop)
+
     def parse_ready(self, data):
-        self._ready_state = ReadyState(launch=asyncio.Event(), servers=[])
+        # a READY that was still waiting for its servers is superseded
+        if self._ready_task is not None:
+            self._ready_task.cancel()
+
+        # a new session supersedes whatever was loaded from a snapshot
+        self._warm = False
+        self.clear()
+        self._ready_state = ReadyState(loop=self.loop)
         self.user = User(**data['user'])
-        guilds = data.get('guilds')
 
-        servers = self._ready_state.servers
-        for guild in guilds:
-            server = self._add_server_from_data(guild)
-            if (not self.is_bot and not server.unavailable) or server.large:
-                servers.append(server)
+        for guild in data.get('guilds'):
+            self._add_ready_server(guild)
 
         for pm in data.get('private_channels'):
             self._add_private_channel(PrivateChannel(self.user, **pm))
 
-        compat.create_task(self._delay_ready(), loop=self.loop)
+        self._ready_task = compat.create_task(self._delay_ready(), loop=self.loop)
+
+    def _add_ready_server(self, guild):
+        state = self._ready_state
+        server = self._add_server_from_data(guild)
+        if server.unavailable:
+            state.pending.add(server.id)
+        elif self.chunk_guilds_at_startup and (server.large or not self.is_bot):
+            state.chunks.append(self.request_chunks(server))
 
     def parse_resumed(self, data):
         self.dispatch('resumed')
+        if self._warm:
+            # the cache came from a snapshot and the session was resumed
+            # so this process will never receive a READY.
+            self._warm = False
+            self.dispatch('ready')
 
     def parse_message_create(self, data):
         channel = self.get_channel(data.get('channel_id'))
         message = self._create_message(channel=channel, **data)
+        if message.server is not None and 'webhook_id' not in data:
+            member = message.author if isinstance(message.author, Member) else None
+            member_data = dict(data['member'], user=data['author']) if 'member' in data else None
+            message.author = self._member_seen(message.server, message.author.id, member,
+                                               member_data) or message.author
+
         self.dispatch('message', message)
         self.messages.append(message)
 
     def parse_message_delete(self, data):
         message_id = data.get('id')
-        found = self._get_message(message_id)
+        found = self.messages.pop(message_id)
         if found is not None:
             self.dispatch('message_delete', found)
-            self.messages.remove(found)
 
     def parse_message_delete_bulk(self, data):
-        message_ids = set(data.get('ids', []))
-        to_be_deleted = list(filter(lambda m: m.id in message_ids, self.messages))
-        for msg in to_be_deleted:
-            self.dispatch('message_delete', msg)
-            self.messages.remove(msg)
+        for message_id in data.get('ids', []):
+            msg = self.messages.pop(message_id)
+            if msg is not None:
+                self.dispatch('message_delete', msg)
 
     def parse_message_update(self, data):
         message = self._get_message(data.get('id'))
@@ -326,7 +872,6 @@ class ConnectionState:
                 return
 
             member = self._make_member(server, data)
-            server._add_member(member)
 
         old_member = member._copy()
         member.status = data.get('status')
@@ -341,6 +886,8 @@ class ConnectionState:
         member.avatar = user.get('avatar', member.avatar)
         member.discriminator = user.get('discriminator', member.discriminator)
 
+        # added (or dropped) now that the member cache policy can see the status
+        server._add_member(member, seen=True)
         self.dispatch('member_update', old_member, member)
 
     def parse_user_update(self, data):
@@ -352,7 +899,7 @@ class ConnectionState:
             channel_id = data.get('id')
             channel = server.get_channel(channel_id)
             if channel is not None:
-                server._remove_channel(channel)
+                self._remove_channel(server, channel)
                 self.dispatch('channel_delete', channel)
 
     def parse_channel_update(self, data):
@@ -371,6 +918,7 @@ class ConnectionState:
             if channel is not None:
                 old_channel = copy.copy(channel)
                 channel._update(server=server, **data)
+                self._reset_history(server, channel)
                 self.dispatch('channel_update', old_channel, channel)
 
     def parse_channel_create(self, data):
@@ -383,7 +931,7 @@ class ConnectionState:
             server = self._get_server(data.get('guild_id'))
             if server is not None:
                 channel = Channel(server=server, **data)
-                server._add_channel(channel)
+                self._add_channel(server, channel)
 
         self.dispatch('channel_create', channel)
 
@@ -406,17 +954,17 @@ class ConnectionState:
     def _make_member(self, server, data):
         roles = [server.default_role]
         for roleid in data.get('roles', []):
-            role = utils.get(server.roles, id=roleid)
+            role = server.get_role(roleid)
             if role is not None:
                 roles.append(role)
 
         data['roles'] = sorted(roles)
-        return Member(server=server, **data)
+        return Member(server=server, **dict(data, user=self._store_user(data['user'])))
 
     def parse_guild_member_add(self, data):
         server = self._get_server(data.get('guild_id'))
         member = self._make_member(server, data)
-        server._add_member(member)
+        server._add_member(member, seen=True)
         server._member_count += 1
         self.dispatch('member_join', member)
 
@@ -424,10 +972,11 @@ class ConnectionState:
         server = self._get_server(data.get('guild_id'))
         if server is not None:
             user_id = data['user']['id']
+            # the member might not be cached because of the member cache policy
+            server._member_count -= 1
             member = server.get_member(user_id)
             if member is not None:
                 server._remove_member(member)
-                server._member_count -= 1
 
                 # remove them from the voice channel member list
                 vc = member.voice_channel
@@ -458,12 +1007,15 @@ class ConnectionState:
 
             # update the roles
             member.roles = [server.default_role]
-            for role in server.roles:
-                if role.id in data['roles']:
+            for role_id in data['roles']:
+                role = server.get_role(role_id)
+                if role is not None:
                     member.roles.append(role)
 
             # sort the roles by ID since they can be "randomised"
             member.roles.sort()
+            if self._is_me(member):
+                self._reset_history(server)
             self.dispatch('member_update', old_member, member)
 
     def parse_guild_emojis_update(self, data):
@@ -472,28 +1024,33 @@ class ConnectionState:
         server.emojis = [Emoji(server=server, **e) for e in data.get('emojis', [])]
         self.dispatch('server_emojis_update', before_emojis, server.emojis)
 
-    def _get_create_server(self, data):
+    def _make_server(self, data):
         if data.get('unavailable') == False:
             # GUILD_CREATE with unavailable in the response
             # usually means that the server has become available
             # and is therefore in the cache
             server = self._get_server(data.get('id'))
             if server is not None:
+                old_channels = list(server.channels)
                 server.unavailable = False
                 server._from_data(data)
+                self._forget_channels(old_channels)
                 return server
 
-        return self._add_server_from_data(data)
+        return Server(state=self, **data)
+
+    def _get_create_server(self, data):
+        server = self._make_server(data)
+        # index the channels the payload brought along
+        self._add_server(server)
+        return server
 
     @asyncio.coroutine
     def _chunk_and_dispatch(self, server, unavailable):
-        chunks = list(self.chunks_needed(server))
-        yield from self.chunker(server)
-        if chunks:
-            try:
-                yield from asyncio.wait(chunks, timeout=len(chunks), loop=self.loop)
-            except asyncio.TimeoutError:
-                log.info('Somehow timed out waiting for chunks.')
+        future = self.request_chunks(server)
+        done, pending = yield from asyncio.wait([future], timeout=_expected_chunks(server), loop=self.loop)
+        if pending:
+            log.info('Timed out waiting for the members of server ID {}.'.format(server.id))
 
         if unavailable == False:
             self.dispatch('server_available', server)
@@ -504,28 +1061,54 @@ class ConnectionState:
         unavailable = data.get('unavailable')
         if unavailable == True:
             # joined a server with unavailable == True so..
+            self._server_created(None, unavailable, data.get('id'))
             return
 
+        if len(data.get('members', ())) + len(data.get('presences', ())) >= SLICE_THRESHOLD:
+            return self._create_server_sliced(data)
+
         server = self._get_create_server(data)
+        self._server_created(server, unavailable, server.id)
+
+    @asyncio.coroutine
+    def _create_server_sliced(self, data):
+        members = data.pop('members', [])
+        presences = data.pop('presences', [])
+        voice_states = data.pop('voice_states', [])
+
+        server = self._make_server(data)
+        yield from self._sliced(members, server._add_member_from_data)
+        yield from self._sliced(presences, server._update_presence)
+        server._resolve_members(voice_states)
+
+        if self.member_cache_policy is not None:
+            yield from self._sliced(list(server.members), server._add_member)
+
+        # a new server is only added once complete. One that became available
+        # again is still cached, so it is seen while it is updated in place.
+        self._add_server(server)
+        self._server_created(server, data.get('unavailable'), server.id)
+
+    def _server_created(self, server, unavailable, server_id):
+        # the _ready_state attribute is only there during
+        # processing of useful READY.
+        state = getattr(self, '_ready_state', None)
+        if state is not None:
+            state.received(server_id)
+
+        if server is None:
+            return
 
         # check if it requires chunking
-        if server.large:
-            if unavailable == False:
-                # check if we're waiting for 'useful' READY
-                # and if we are, we don't want to dispatch any
-                # event such as server_join or server_available
-                # because we're still in the 'READY' phase. Or
-                # so we say.
-                try:
-                    state = self._ready_state
-                    state.launch.clear()
-                    state.servers.append(server)
-                except AttributeError:
-                    # the _ready_state attribute is only there during
-                    # processing of useful READY.
-                    pass
-                else:
-                    return
+        if server.large and self.chunk_guilds_at_startup:
+            if unavailable == False and state is not None:
+                # we're waiting for 'useful' READY so we don't want to
+                # dispatch any event such as server_join or
+                # server_available because we're still in the 'READY'
+                # phase. Or so we say. The members are requested right
+                # away and READY completes once they all arrived.
+                state.chunks.append(self.request_chunks(server))
+                return
 
             # since we're not waiting for 'useful' READY we'll just
             # do the chunk request here
@@ -540,16 +1123,26 @@ class ConnectionState:
 
     def parse_guild_sync(self, data):
         server = self._get_server(data.get('id'))
+        old_channels = list(server.channels)
         server._sync(data)
+        self._forget_channels(old_channels)
+        self._add_server(server)
 
     def parse_guild_update(self, data):
         server = self._get_server(data.get('id'))
         if server is not None:
             old_server = copy.copy(server)
             server._from_data(data)
+            if 'channels' in data:
+                self._forget_channels(old_server.channels)
+                self._add_server(server)
             self.dispatch('server_update', old_server, server)
 
     def parse_guild_delete(self, data):
+        state = getattr(self, '_ready_state', None)
+        if state is not None:
+            state.received(data.get('id'))
+
         server = self._get_server(data.get('id'))
         if server is None:
             return
@@ -558,11 +1151,14 @@ class ConnectionState:
             # GUILD_DELETE with unavailable being True means that the
             # server that was available is now currently unavailable
             server.unavailable = True
+            # no messages are received while the server is unavailable
+            self._reset_history(server)
             self.dispatch('server_unavailable', server)
             return
 
         # do a cleanup of the messages cache
-        self.messages = deque((msg for msg in self.messages if msg.server != server), maxlen=self.max_messages)
+        for msg in [msg for msg in self.messages if msg.server == server]:
+            self.messages.pop(msg.id)
 
         self._remove_server(server)
         self.dispatch('server_remove', server)
@@ -597,40 +1193,66 @@ class ConnectionState:
     def parse_guild_role_delete(self, data):
         server = self._get_server(data.get('guild_id'))
         if server is not None:
-            role_id = data.get('role_id')
-            role = utils.find(lambda r: r.id == role_id, server.roles)
-            try:
+            role = server.get_role(data.get('role_id'))
+            if role is not None:
                 server._remove_role(role)
-            except ValueError:
-                return
-            else:
+                self._reset_history(server)
                 self.dispatch('server_role_delete', role)
 
     def parse_guild_role_update(self, data):
         server = self._get_server(data.get('guild_id'))
         if server is not None:
-            role_id = data['role']['id']
-            role = utils.find(lambda r: r.id == role_id, server.roles)
+            role = server.get_role(data['role']['id'])
             if role is not None:
                 old_role = copy.copy(role)
                 role._update(**data['role'])
+                # the position might have changed
+                server._role_hierarchy = None
+                self._reset_history(server)
                 self.dispatch('server_role_update', old_role, role)
 
     def parse_guild_members_chunk(self, data):
         server = self._get_server(data.get('guild_id'))
         members = data.get('members', [])
-        for member in members:
+        added = []
+
+        def add_member(member):
             m = self._make_member(server, member)
             existing = server.get_member(m.id)
             if existing is None or existing.joined_at is None:
                 server._add_member(m)
+                added.append(m)
+            else:
+                added.append(existing)
 
+        if len(members) >= SLICE_THRESHOLD:
+            return self._members_chunk_sliced(server, data, add_member, added)
+
+        for member in members:
+            add_member(member)
+        self._members_chunk_done(server, data, added)
+
+    @asyncio.coroutine
+    def _members_chunk_sliced(self, server, data, add_member, added):
+        yield from self._sliced(data['members'], add_member)
+        self._members_chunk_done(server, data, added)
+
+    def _members_chunk_done(self, server, data, added):
         # if the owner is offline, server.owner is potentially None
         # therefore we should check if this chunk makes it point to a valid
         # member.
         server.owner = server.get_member(server.owner_id)
-        log.info('processed a chunk for {} members.'.format(len(members)))
-        self.process_listeners(ListenerType.chunk, server, len(members))
+        log.info('processed a chunk for {} members.'.format(len(added)))
+
+        query = self._get_member_query(data)
+        if query is not None:
+            query.receive(data, added)
+            return
+
+        request = self._chunk_requests.get(server.id)
+        if request is not None and request.receive(data):
+            del self._chunk_requests[server.id]
+            server._chunked = True
 
     def parse_voice_state_update(self, data):
         server = self._get_server(data.get('guild_id'))
@@ -641,8 +1263,13 @@ class ConnectionState:
                 if voice is not None:
                     voice.channel = channel
 
+            if server.get_member(data.get('user_id')) is None and 'member' in data:
+                # not cached because of the member cache policy
+                server._add_member_from_data(data['member'])
+
             before, after = server._update_voice_state(data)
             if after is not None:
+                server._add_member(after, seen=True)
                 self.dispatch('voice_state_update', before, after)
         else:
             # in here we're either at private or group calls
@@ -662,7 +1289,12 @@ class ConnectionState:
             if is_private:
                 member = channel.user
             else:
-                member = channel.server.get_member(user_id)
+                server = channel.server
+                member = self._member_seen(server, user_id, server.get_member(user_id), data.get('member'))
+                if member is None and self.member_cache_policy is not None:
+                    # not cached because of the member cache policy and the
+                    # event has no member data, the user might still be known.
+                    member = self._users.get(user_id)
 
             if member is not None:
                 timestamp = datetime.datetime.utcfromtimestamp(data.get('timestamp'))
@@ -723,17 +1355,11 @@ class ConnectionState:
         if id is None:
             return None
 
-        for server in self.servers:
-            channel = server.get_channel(id)
-            if channel is not None:
-                return channel
+        channel = self._channels.get(id)
+        if channel is not None:
+            return channel
 
         pm = self._get_private_channel(id)
         if pm is not None:
             return pm
 
-    def receive_chunk(self, guild_id):
-        future = asyncio.Future(loop=self.loop)
-        listener = Listener(ListenerType.chunk, future, lambda s: s.id == guild_id)
-        self._listeners.append(listener)
-        return future
@@ -27,45 +27,12 @@ DEALINGS IN THE SOFTWARE.
 from .utils import snowflake_time
 from .enums import DefaultAvatar
 
-class User:
-    """Represents a Discord user.
+import abc
 
-    Supported Operations:
-
-    +-----------+---------------------------------------------+
-    | Operation |                 Description                 |
-    +===========+=============================================+
-    | x == y    | Checks if two users are equal.              |
-    +-----------+---------------------------------------------+
-    | x != y    | Checks if two users are not equal.          |
-    +-----------+---------------------------------------------+
-    | hash(x)   | Return the user's hash.                     |
-    +-----------+---------------------------------------------+
-    | str(x)    | Returns the user's name with discriminator. |
-    +-----------+---------------------------------------------+
-
-    Attributes
-    -----------
-    name : str
-        The user's username.
-    id : str
-        The user's unique ID.
-    discriminator : str or int
-        The user's discriminator. This is given when the username has conflicts.
-    avatar : str
-        The avatar hash the user has. Could be None.
-    bot : bool
-        Specifies if the user is a bot account.
-    """
-
-    __slots__ = ['name', 'id', 'discriminator', 'avatar', 'bot']
-
-    def __init__(self, **kwargs):
-        self.name = kwargs.get('username')
-        self.id = kwargs.get('id')
-        self.discriminator = kwargs.get('discriminator')
-        self.avatar = kwargs.get('avatar')
-        self.bot = kwargs.get('bot', False)
+class BaseUser:
+    # the behaviour of a User. Member shares it without subclassing User,
+    # since the slots of User would cost every member memory it never uses.
+    __slots__ = []
 
     def __str__(self):
         return '{0.name}#{0.discriminator}'.format(self)
@@ -156,3 +123,43 @@ class User:
             return True
 
         return False
+
+class User(BaseUser, metaclass=abc.ABCMeta):
+    """Represents a Discord user.
+
+    Supported Operations:
+
+    +-----------+---------------------------------------------+
+    | Operation |                 Description                 |
+    +===========+=============================================+
+    | x == y    | Checks if two users are equal.              |
+    +-----------+---------------------------------------------+
+    | x != y    | Checks if two users are not equal.          |
+    +-----------+---------------------------------------------+
+    | hash(x)   | Return the user's hash.                     |
+    +-----------+---------------------------------------------+
+    | str(x)    | Returns the user's name with discriminator. |
+    +-----------+---------------------------------------------+
+
+    Attributes
+    -----------
+    name : str
+        The user's username.
+    id : str
+        The user's unique ID.
+    discriminator : str or int
+        The user's discriminator. This is given when the username has conflicts.
+    avatar : str
+        The avatar hash the user has. Could be None.
+    bot : bool
+        Specifies if the user is a bot account.
+    """
+
+    __slots__ = ['name', 'id', 'discriminator', 'avatar', 'bot', '__weakref__']
+
+    def __init__(self, **kwargs):
+        self.name = kwargs.get('username')
+        self.id = kwargs.get('id')
+        self.discriminator = kwargs.get('discriminator')
+        self.avatar = kwargs.get('avatar')
+        self.bot = kwargs.get('bot', False)
@@ -31,6 +31,22 @@ from base64 import b64encode
 import asyncio
 import json
 import warnings, functools
+from collections import namedtuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import rapidjson
+except ImportError:
+    rapidjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
 
 DISCORD_EPOCH = 1420070400000
 
@@ -251,3 +267,63 @@ def _bytes_to_base64_data(data):
 def to_json(obj):
     return json.dumps(obj, separators=(',', ':'), ensure_ascii=True)
 
+JSONCodec = namedtuple('JSONCodec', 'name dumps loads')
+
+def _decode_bytes(loads):
+    def decoder(data):
+        if isinstance(data, (bytes, bytearray)):
+            data = data.decode('utf-8')
+        return loads(data)
+    return decoder
+
+_json_codecs = {
+    'json': JSONCodec('json', to_json, _decode_bytes(json.loads))
+}
+
+if orjson is not None:
+    # orjson only produces bytes but the gateway expects text frames
+    _json_codecs['orjson'] = JSONCodec('orjson', lambda obj: orjson.dumps(obj).decode('utf-8'), orjson.loads)
+
+if rapidjson is not None:
+    _json_codecs['rapidjson'] = JSONCodec('rapidjson', rapidjson.dumps, _decode_bytes(rapidjson.loads))
+
+if ujson is not None:
+    _json_codecs['ujson'] = JSONCodec('ujson', lambda obj: ujson.dumps(obj, escape_forward_slashes=False), ujson.loads)
+
+def get_json_codec(codec=None):
+    """Resolves the JSON codec used for the gateway and HTTP requests.
+
+    Parameters
+    -----------
+    codec
+        The codec to resolve. This could be ``None`` for the standard
+        library ``json`` module, ``'auto'`` to pick the fastest installed
+        library, the name of a library (one of ``'json'``, ``'orjson'``,
+        ``'rapidjson'`` or ``'ujson'``) or an object with ``dumps`` and
+        ``loads`` attributes. ``loads`` must accept both ``str`` and
+        ``bytes`` and ``dumps`` must return a ``str``.
+
+    Raises
+    -------
+    InvalidArgument
+        The codec could not be resolved.
+    """
+    if codec is None:
+        return _json_codecs['json']
+
+    if codec == 'auto':
+        for name in ('orjson', 'rapidjson', 'ujson', 'json'):
+            if name in _json_codecs:
+                return _json_codecs[name]
+
+    if isinstance(codec, str):
+        try:
+            return _json_codecs[codec]
+        except KeyError:
+            raise InvalidArgument('JSON codec {!r} is not installed or supported'.format(codec)) from None
+
+    if not (callable(getattr(codec, 'dumps', None)) and callable(getattr(codec, 'loads', None))):
+        raise InvalidArgument('JSON codec must have dumps and loads callables')
+
+    return JSONCodec(getattr(codec, 'name', codec.__class__.__name__), codec.dumps, codec.loads)
+